@@ -1,5 +1,6 @@
 import os
 import time
+import zipfile
 from pathlib import Path
 
 from PySide6.QtCore import QCoreApplication, QUrl
@@ -110,10 +111,13 @@ class MainWindowModelView:
             start = time.perf_counter()
             # Open the file and use the file-loader function to read the data
             # into the application
-            with open(str(filename), 'rb') as read_file:
-              FileLoaderSaver.load_file(read_file)
+            if zipfile.is_zipfile(str(filename)):
+                FileLoaderSaver.load_archive(filename)
+            else:
+                with open(str(filename), 'rb') as read_file:
+                  FileLoaderSaver.load_file(read_file)
             end = time.perf_counter()
-            print(f"Opened the pickle forecast in {end - start:.2f} seconds.")
+            print(f"Opened the forecast in {end - start:.2f} seconds.")
 
             # Update the application configuration and current file name
             app.current_file = Path(filename)
@@ -142,10 +146,19 @@ class MainWindowModelView:
 
         start = time.perf_counter()
         # Save the file using the file-loader-saver module
-        with open(app.current_file, 'wb') as write_file:
-            FileLoaderSaver.save_to_file(write_file)
+        if app.settings.get('forecast_file_format', 'pickle') == 'archive':
+            try:
+                FileLoaderSaver.save_archive(app.current_file)
+            except PermissionError as e:
+                QMessageBox.warning(app.gui, 'Could not save the file', str(e))
+                return
+        else:
+            # The file may be an archive whose data is mapped
+            FileLoaderSaver.release_mappings(app.current_file)
+            with open(app.current_file, 'wb') as write_file:
+                FileLoaderSaver.save_to_file(write_file)
         end = time.perf_counter()
-        print(f"Saved the pickle forecast in {end - start:.2f} seconds.")
+        print(f"Saved the forecast in {end - start:.2f} seconds.")
 
         # Update the application with the file name and update the config.
         app.gui.status_bar.showMessage(
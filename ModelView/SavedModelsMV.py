@@ -1,5 +1,4 @@
 from datetime import datetime
-from inspect import signature
 from math import factorial
 
 import numpy as np
@@ -10,6 +9,8 @@ from PySide6.QtWidgets import (QApplication, QDialog, QMessageBox, QVBoxLayout,
 from scipy.interpolate import InterpolatedUnivariateSpline
 
 from Utilities.ColorCycler import ColorCycler
+from Utilities.ForecastEngine import (
+    N_BOOTSTRAPS, N_RESIDUALS, ForecastJob, ForecastEngine)
 from Utilities.HydrologyDateTimes import convert_to_water_year
 from Views import ForecastViewer, ExceedanceViewer
 
@@ -138,8 +139,8 @@ class SavedModelsModelView:
             self.sm.prob_plot.setLabel(
                 'bottom',
                 f'{model.predictand.dataset().parameter} [{model.predictand.unit.id}]')
-            if year in model.forecasts.forecasts.index.get_level_values(0):
-                values = model.forecasts.forecasts.loc[(year, slice(None))]
+            if year in model.forecasts:
+                values = model.forecasts.get(year).to_frame()
                 if df is not None:
                     df = pd.concat([df, values], axis=1)
                 else:
@@ -261,14 +262,17 @@ class genModelDialog(QDialog):
         self.year_ = 2000
         self.setMinimumWidth(500)
 
+        # The ForecastEngine running this dialog's forecasts, if any
+        self.engine = None
+
     def closeEvent(self, event):
         self.finish()
         event.accept()
 
     def resample_all_data(self, model):
         for predictor in model.predictors:
-            predictor.resample()
-        model.predictand.resample()
+            predictor.data = app.training_cache.resampled(predictor)
+        model.predictand.data = app.training_cache.resampled(model.predictand)
 
     def parse_years(self, input):
         output = []
@@ -282,126 +286,130 @@ class genModelDialog(QDialog):
         output.sort()
         return output
 
+    def missing_data(self, label, fcst_year):
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Icon.Warning)
+        msg.setText(
+            'We do not have all the data yet for year: ' + str(fcst_year))
+        msg.setWindowTitle('Error in Generating Forecast')
+        msg.setStandardButtons(QMessageBox.StandardButton.Ok)
+
+        retv = msg.exec()
+        label.setMessage(
+            f'Could not forecast for year: {fcst_year} - Missing data')
+
+    def forecast_job(self, model, df, fcst_year):
+        """Builds the ForecastJob for forecasting 'fcst_year' with 'model'
+        ('df' is the model's collated data), or returns None if the data for
+        'fcst_year' is missing."""
+
+        if fcst_year not in df.index:
+            return None
+        x_fcst_year = df.loc[[fcst_year]].iloc[0].iloc[:-1]
+        if x_fcst_year.dropna().empty:
+            return None
+        x_fcst_year = x_fcst_year.values
+        df = df.loc[convert_to_water_year(
+            model.training_period_start):convert_to_water_year(
+            model.training_period_end)].dropna()
+        df = df.drop(model.training_exclude_dates, errors='ignore')
+
+        # Dont train on the year we're trying to forecast
+        if fcst_year in df.index:
+            df = df.drop(fcst_year)
+
+        return ForecastJob(
+            model.guid, fcst_year, df.values[:, :-1], df.values[:, -1],
+            x_fcst_year, model.regression_model, model.cross_validator,
+            model.predictand.preprocessing,
+            getattr(model.predictand, 'params', None),
+            pc_retain=app.settings['max_pc_mode_variance'],
+            n_bootstraps=app.settings.get('forecast_bootstraps', N_BOOTSTRAPS),
+            n_residuals=app.settings.get('forecast_residuals', N_RESIDUALS))
+
     def generate_forecasts(self):
 
+        # Events are processed while forecasting, so the button can be
+        # pressed again
+        if self.engine is not None:
+            return
+        self.gen_button.setEnabled(False)
+        try:
+            self.engine = ForecastEngine(
+                app.settings.get('worker_processes', 1), idle=app.processEvents)
+            cancelled = not self.run_forecasts(self.engine)
+        finally:
+            self.engine = None
+            self.gen_button.setEnabled(True)
+
+        if cancelled:
+            return
+
+        self.last_year.emit(self.year_)
+        self.finished.emit(1)
+        app.processEvents()
+
+    def run_forecasts(self, engine):
+        """Forecasts the years in the year input with every model, using
+        'engine'. Returns False if the dialog was closed (the engine was
+        cancelled) before the forecasts were done."""
+
         fcst_years = self.parse_years(self.year_input.text())
         self.year_ = fcst_years[-1]
-        total = len(self.idx_list) * len(fcst_years)
-        inc = 100 / total
 
+        # Collect every (model, year) forecast to run
+        jobs, labels, totals = [], {}, {}
         for i in range(len(self.idx_list)):
             idx = self.idx_list[i]
             model = app.saved_models[idx.row()]
             app.processEvents()
+            if engine.cancelled:
+                return False
             self.labels[i].setMessage('Resampling Data...')
             self.resample_all_data(model)
-            for y, fcst_year in enumerate(fcst_years):
-                self.labels[i].setMessage(f'Forecasting for year: {fcst_year}')
-
-                regression_algorithm = app.regressors[model.regression_model](
-                    cross_validation=model.cross_validator)
-                df = pd.DataFrame()
-                for predictor in model.predictors:
-                    df = pd.concat([df, predictor.data], axis=1)
-                df = pd.concat([df, model.predictand.data], axis=1).sort_index()
-                if fcst_year not in df.index:
-                    msg = QMessageBox(self)
-                    msg.setIcon(QMessageBox.Icon.Warning)
-                    msg.setText(
-                        'We do not have all the data yet for year: ' + str(fcst_year))
-                    msg.setWindowTitle('Error in Generating Forecast')
-                    msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                    retv = msg.exec()
-                    self.labels[i].setMessage(
-                        f'Could not forecast for year: {fcst_year} - Missing data')
-                    continue
-                x_fcst_year = df.loc[[fcst_year]].iloc[0].iloc[:-1]
-                if x_fcst_year.dropna().empty:
-                    msg = QMessageBox(self)
-                    msg.setIcon(QMessageBox.Icon.Warning)
-                    msg.setText(
-                        'We do not have all the data yet for year: ' + str(fcst_year))
-                    msg.setWindowTitle('Error in Generating Forecast')
-                    msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                    retv = msg.exec()
-                    self.labels[i].setMessage(
-                        f'Could not forecast for year: {fcst_year} - Missing data')
+            df = app.training_cache.collate(
+                model.guid, model.predictors, model.predictand)
+            labels[model.guid] = (self.labels[i], model)
+            totals[model.guid] = 0
+            for fcst_year in fcst_years:
+                job = self.forecast_job(model, df, fcst_year)
+                if job is None:
+                    self.missing_data(self.labels[i], fcst_year)
                     continue
-                x_fcst_year = x_fcst_year.values
-                df = df.loc[convert_to_water_year(
-                    model.training_period_start):convert_to_water_year(
-                    model.training_period_end)].dropna()
-                df = df.drop(model.training_exclude_dates, errors='ignore')
-
-                # Dont train on the year we're trying to forecast
-                if fcst_year in df.index:
-                    df = df.drop(fcst_year)
-
-                x_data = df.values[:, :-1]
-                predictand_data = df.values[:, -1]
-
-                n = x_data.shape[0]  # num samples
-                n_bootstraps = 300  # Must be a multiple of 10
-                bootstrap_predictions, validation_residuals = np.empty(n_bootstraps), []
-
-                for b in range(n_bootstraps):
-                    self.labels[i].setMessage(
-                        f'Year: {fcst_year} → Bootstrapping: {b + 1:>4} / {n_bootstraps:>4}')
-                    total_prog = len(fcst_years) * n_bootstraps
-                    current_prog = b + (y * n_bootstraps)
-                    self.labels[i].setProgress(current_prog / total_prog)
-                    self.update()
-                    app.processEvents()
-                    train_idxs = np.random.choice(range(n), size=n, replace=True)
-                    val_idxs = np.array(
-                        [idx for idx in range(n) if idx not in train_idxs])
-                    _, _ = regression_algorithm.cross_val_predict(
-                        x_data[train_idxs, :], predictand_data[train_idxs])
-                    preds = regression_algorithm.predict(x_data[val_idxs])
-                    validation_residuals.append(predictand_data[val_idxs] - preds)
-                    bootstrap_predictions[b] = regression_algorithm.predict(x_fcst_year)
-                bootstrap_predictions -= np.mean(bootstrap_predictions)
-                validation_residuals = np.concatenate(validation_residuals)
-
-                _, _ = regression_algorithm.cross_val_predict(x_data, predictand_data)
-                predictions = regression_algorithm.predict(x_data)
-                forecast = regression_algorithm.predict(x_fcst_year)
-                train_residuals = predictand_data - predictions
-
-                validation_residuals = np.percentile(
-                    validation_residuals, q=np.arange(100), method='linear')
-                train_residuals = np.percentile(
-                    train_residuals, q=np.arange(100), method='linear')
-
-                no_information_error = np.mean(np.abs(
-                    np.random.permutation(predictand_data) - np.random.permutation(
-                        predictions)))
-                generalisation = np.abs(
-                    validation_residuals.mean() - train_residuals.mean())
-                no_information_val = np.abs(no_information_error - train_residuals)
-                relative_overfitting_rate = np.mean(generalisation / no_information_val)
-                weight = .632 / (1 - .368 * relative_overfitting_rate)
-                residuals = (1 - weight) * train_residuals + weight * validation_residuals
-                C = np.array([m + o for m in bootstrap_predictions for o in residuals])
-                qs = np.arange(1, 100, 0.25)
-                percentiles = np.percentile(C, q=qs) + forecast
-
-                method = app.preprocessing_methods[
-                    'INV_' + model.predictand.preprocessing]
-                if len(signature(method).parameters) > 1:
-                    percentiles = method(percentiles, **model.predictand.params)
-                else:
-                    percentiles = method(percentiles)
-
-                model.forecasts.set_forecasts_1_99(fcst_year, percentiles)
-        self.last_year.emit(self.year_)
-        self.finished.emit(1)
-        app.processEvents()
+                jobs.append(job)
+                totals[model.guid] += 1
+            if totals[model.guid]:
+                self.labels[i].setMessage(
+                    f'Forecasting {totals[model.guid]} year(s)...')
+
+        completed = dict.fromkeys(totals, 0)
+
+        def progress(job, values, error):
+            # Jobs that were already running finish after a cancel
+            if engine.cancelled:
+                return
+            label, model = labels[job.guid]
+            completed[job.guid] += 1
+            label.setProgress(completed[job.guid] / totals[job.guid])
+            if error is not None:
+                label.setMessage(f'Could not forecast for year: {job.year} - {error}')
+                return
+            model.forecasts.set_forecasts_1_99(job.year, values)
+            label.setMessage(f'Forecasted year: {job.year}')
+
+        if engine.cancelled:
+            return False
+        engine.progress = progress
+        engine.run(jobs)
+
+        return not engine.cancelled
 
     def finish(self):
 
+        # Stop any forecasts that are running
+        if self.engine is not None:
+            self.engine.cancel()
+
         self.last_year.emit(self.year_)
 
         # self.finished.emit()
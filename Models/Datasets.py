@@ -12,13 +12,17 @@ dataset (in this case, a pandas series object containing the data.)
 displays those datasets in lists and drop-down views.
 """
 
+from itertools import count
 from uuid import uuid4
 
+import numpy as np
 import pandas as pd
 from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
 from PySide6.QtWidgets import QApplication
 
 from Models.Units import Unit
+from Utilities.DailyStore import DailyStore
+from Utilities.ForecastArchive import MappedSeries, mapped_file
 
 # Get the global application
 app = QApplication.instance()
@@ -68,6 +72,41 @@ def color(dataset):
         return 'red'
 
 
+# Source of the data versions of every dataset in the session, so that a
+# version number is never shared by two different sets of data.
+DATA_VERSIONS = count(1)
+
+
+def changed_span(old, new):
+    """Returns the (first, last) dates at which the series 'new' differs from
+    the series 'old', or None if they contain the same data."""
+
+    if old is not new and old.index.is_unique and new.index.is_unique:
+
+        if old.index.equals(new.index):
+            index, a, b = new.index, old.values, new.values
+        else:
+            index = old.index.union(new.index)
+            a, b = old.reindex(index).values, new.reindex(index).values
+
+        changed = np.asarray(~((a == b) | (pd.isna(a) & pd.isna(b))))
+        if changed.ndim > 1:
+            changed = changed.any(axis=1)
+        if not changed.any():
+            return None
+        dates = index[changed]
+
+    else:
+
+        # The data was edited in place (or has duplicate dates), so any date
+        # may have changed
+        dates = old.index.append(new.index)
+        if dates.empty:
+            return None
+
+    return dates.min(), dates.max()
+
+
 class Dataset:
     """Dataset Class
 
@@ -94,11 +133,22 @@ class Dataset:
     "display_unit": an instance of a `Unit` that is the unit displayed and used
                     in the forecasts.
     "data" : A pandas Series object containing the data for this dataset.
+             With the "compact_dataset_storage" setting, daily data is
+             kept in a `DailyStore` and "data" is built when it's read, so
+             it has to be assigned (not edited in place) to change it.
+             The same goes for data opened from an archive forecast file,
+             which is read from the file when it's first used.
+    "data_version" : increases every time "data" is set to different data
+    "changed_span" : the (first, last) dates changed by the last change to
+                     "data", or None if it's never been changed
 
     """
     is_file_import = False
     file_path = ""
 
+    # Session state that isn't saved with the dataset
+    _not_saved = ['_data', 'data_version', 'changed_span']
+
     def __init__(self, **kwargs):
 
         # Dataset parameters
@@ -111,13 +161,78 @@ class Dataset:
         self.dataloader = None
         self.raw_unit = Unit()
         self.display_unit = Unit()
-        self.data = pd.Series(index=pd.DatetimeIndex([]), name=self.guid, dtype=float)
+        self._data = pd.Series(index=pd.DatetimeIndex([]), name=self.guid, dtype=float)
+        self.data_version = next(DATA_VERSIONS)
+        self.changed_span = None
 
         # Load in all args and kwargs into the dataset definition
+        data = kwargs.pop('data', None)
         self.__dict__.update(**kwargs)
+        if isinstance(data, (DailyStore, MappedSeries)):
+            self._data = data
+        elif data is not None:
+            self.data = data
 
         return
 
+    def __setstate__(self, state):
+        """Restores datasets pickled before "data" was versioned."""
+
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        self.__dict__.update(state)
+        self.data_version = next(DATA_VERSIONS)
+        self.changed_span = None
+
+    @property
+    def data(self):
+        if isinstance(self._data, (DailyStore, MappedSeries)):
+            return self._data.series()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+
+        span = changed_span(self.data, data)
+        self._data = data
+        if app.settings.get('compact_dataset_storage', False):
+            store = DailyStore.from_series(
+                data, app.settings.get('compact_dataset_dtype', 'float64'))
+            if store is not None:
+                self._data = store
+        if span is not None:
+            self.data_changed(*span)
+
+    @property
+    def store(self):
+        """The dataset's `DailyStore`, or None if it isn't stored compactly."""
+        return self._data if isinstance(self._data, DailyStore) else None
+
+    @property
+    def mapped_file(self):
+        """The forecast file that the data is memory-mapped from, or None."""
+
+        if isinstance(self._data, (DailyStore, MappedSeries)):
+            return mapped_file(self._data.values)
+
+        return None
+
+    def read_mapped_data(self):
+        """Reads data that's memory-mapped from a forecast file into memory."""
+        if self.mapped_file is not None:
+            self._data = self._data.copy()
+
+    def data_changed(self, start=None, end=None):
+        """Records a change to the data between 'start' and 'end' (the whole
+        dataset by default). Call this after editing "data" in place."""
+
+        if start is None:
+            start = self.data.index.min()
+        if end is None:
+            end = self.data.index.max()
+        self.data_version = next(DATA_VERSIONS)
+        self.changed_span = (start, end)
+
     def raw_convert(self):
 
         scale, offset = self.raw_unit.convert_to(self.display_unit)
@@ -201,6 +316,11 @@ class Datasets(QAbstractListModel):
     stores Dataset objects in a structured model that can
     be directly accessed by Qt views such as listviews or
     tableviews.
+
+    Datasets are also indexed by GUID and by upper-case name for fast
+    lookups. Code that changes the "datasets" list directly should call
+    `reindex` afterwards (index hits are checked against the list, and
+    lookups fall back to a scan of the list if it doesn't).
     """
 
     # Define model roles
@@ -212,9 +332,33 @@ class Datasets(QAbstractListModel):
 
         super().__init__(parent)
         self.datasets = []  # Stores datasets in an internal list
+        self.guid_index = {}  # guid -> (position in datasets, dataset)
+        self.name_index = {}  # upper-case name -> [datasets]
 
         return
 
+    def index_dataset(self, dataset, position=None):
+        """Adds a dataset to the lookup indexes (by default, as the last
+        dataset in the list)"""
+        if position is None:
+            position = len(self.datasets) - 1
+        self.guid_index[dataset.guid] = (position, dataset)
+        self.name_index.setdefault(dataset.name.upper(), []).append(dataset)
+
+    def reindex(self):
+        """Rebuilds the lookup indexes from the datasets list"""
+        self.guid_index = {}
+        self.name_index = {}
+        for i, dataset in enumerate(self.datasets):
+            self.index_dataset(dataset, i)
+
+    def indexed(self, dataset):
+        """Whether the indexes still hold 'dataset' where it is in the
+        datasets list (i.e. it hasn't been removed or replaced since)"""
+        position, indexed = self.guid_index.get(dataset.guid, (-1, None))
+        return (indexed is dataset and 0 <= position < len(self.datasets)
+                and self.datasets[position] is dataset)
+
     def columnCount(self, parent):
         """Returns the number of model columns"""
         return 2
@@ -222,6 +366,7 @@ class Datasets(QAbstractListModel):
     def clear(self):
         """Clears all datasets from the model and re-initializes the model"""
         self.datasets = []
+        self.reindex()
         QAbstractListModel.__init__(self)
 
     def data(self, index=QModelIndex(), role=Qt.ItemDataRole.DisplayRole):
@@ -254,22 +399,37 @@ class Datasets(QAbstractListModel):
 
     def get_dataset_by_name_and_parameter(self, name, param):
         """retrieves a dataset from the model that matches the given name and parameter"""
+        for dataset in self.name_index.get(name.upper(), []):
+            if dataset.name.upper() == name.upper() and self.indexed(dataset):
+                if dataset.parameter.upper() in param.upper():
+                    return dataset
+
         for dataset in self.datasets:
             if dataset.name.upper() == name.upper():
                 if dataset.parameter.upper() in param.upper():
+                    self.reindex()
                     return dataset
 
     def get_dataset_by_guid(self, guid):
         """Retrieves a dataset from the model that matches the given UUID"""
+        _, dataset = self.guid_index.get(guid, (-1, None))
+        if dataset is not None and dataset.guid == guid and self.indexed(dataset):
+            return dataset
+
         for dataset in self.datasets:
             if dataset.guid == guid:
+                self.reindex()
                 return dataset
 
+        # Not in the list, so drop any stale entry
+        self.guid_index.pop(guid, None)
+
     def update_dataset_by_guid(self, guid, new_dataset):
         """Changes the dataset for the given UUID to the new dataset provided"""
         for i, dataset in enumerate(self.datasets):
             if dataset.guid == guid:
                 self.datasets[i] = new_dataset
+                self.reindex()
                 self.dataChanged.emit(self.index(i), self.index(i))
                 print(f'Updated Dataset: {new_dataset}')
                 return
@@ -295,6 +455,7 @@ class Datasets(QAbstractListModel):
         if dataset in self.datasets:
             return None
         self.datasets.append(dataset)
+        self.index_dataset(dataset)
         self.insertRow(self.rowCount())
 
         self.dataChanged.emit(self.index(0), self.index(self.rowCount()))
@@ -322,6 +483,7 @@ class Datasets(QAbstractListModel):
             idx = self.datasets.index(dataset)
             self.beginRemoveRows(QModelIndex(), idx, idx)
             dataset = self.datasets.pop(idx)
+            self.reindex()
             self.removeRow(idx)
             self.endRemoveRows()
             print(f'Removed Dataset: {dataset}')
@@ -331,6 +493,7 @@ class Datasets(QAbstractListModel):
             idx = args[0]
             self.beginRemoveRows(QModelIndex(), idx, idx)
             dataset = self.datasets.pop(idx)
+            self.reindex()
             self.removeRow(idx)
             self.endRemoveRows()
             print(f'Removed Dataset: {dataset}')
@@ -353,6 +516,7 @@ class Datasets(QAbstractListModel):
 
     def __setitem__(self, index, **kwargs):
         self.datasets[index] = Dataset(**kwargs)
+        self.reindex()
 
     def __len__(self):
         return len(self.datasets)
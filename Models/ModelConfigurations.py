@@ -2,13 +2,16 @@ import pickle
 from inspect import signature
 from uuid import uuid4
 
+import numpy as np
 import pandas as pd
 from PySide6.QtCore import Qt, QModelIndex, QAbstractTableModel, QAbstractListModel
 from PySide6.QtWidgets import QApplication
 from numpy import nan
 
 from Models.Datasets import Dataset
+from Resources.AggMethods import SEGMENT_METHODS
 from Utilities.HydrologyDateTimes import convert_to_water_year
+from Utilities.TrainingCache import RESAMPLE_MEMO
 
 app = QApplication.instance()
 
@@ -62,13 +65,32 @@ class ResampledDataset:
 
         if not self.dataset().data.empty:
 
+            # Reuse the result of an identical resample of the same data
+            key = RESAMPLE_MEMO.key(self)
+            memo = RESAMPLE_MEMO.get(key)
+            if memo is not None:
+                self.data, params = memo
+                if params is not None:
+                    self.params = params
+                return
+
             self.data = pd.Series([], index=pd.DatetimeIndex([]), dtype='float64')
 
             dataset = self.dataset()
 
+            # Compactly stored datasets have a value (or NaN) for every day,
+            # so their periods can be found without building the Series
+            store = dataset.store if self.agg_method in SEGMENT_METHODS else None
+
             # reference to raw data for convienence
             # scale, offset = dataset.raw_unit.convert_to(dataset.display_unit)
-            raw = dataset.data  # *scale + offset
+            if store is not None:
+                first, last = store.first_date, store.last_date
+            else:
+                raw = dataset.data  # *scale + offset
+                if not raw.index.is_monotonic_increasing:
+                    raw = raw.sort_index()
+                first, last = raw.index[0], raw.index[-1]
 
             # get the agg method
             a = app.agg_methods[self.agg_method]
@@ -76,24 +98,42 @@ class ResampledDataset:
             # Compute period duration
             days = (self.period_end - self.period_start).days
 
-            # Create the periods
-            start = self.period_start.replace(year=raw.index[0].year - 1)
-            tracker = pd.Timestamp(start)
-            periods = []
-            while tracker <= raw.index[-1]:
-                periods.append((tracker, tracker + pd.DateOffset(days=days)))
-                tracker += pd.DateOffset(years=1)
-
-            # Resample the data
-            for idx in pd.IntervalIndex.from_tuples(periods):
-                d = raw[idx.left:idx.right].dropna()
-                if len(d >= 1):
-                    self.data.loc[idx.left] = a(d)
-                else:
-                    self.data.loc[idx.left] = nan
+            # Create the periods, one a year from the year before the data
+            # starts until the last one that starts within the data
+            years = np.arange(first.year - 1, last.year + 1)
+            lefts = pd.to_datetime(pd.DataFrame({
+                'year': years,
+                'month': self.period_start.month,
+                'day': self.period_start.day
+            }))
+            lefts = lefts[lefts <= last]
+            rights = lefts + pd.Timedelta(days=days)
+
+            # Find the values that fall in each period (both ends inclusive),
+            # and aggregate the periods that have any non-missing values
+            if store is not None:
+                starts, ends = store.locate(lefts.values, rights.values)
+            else:
+                times = raw.index.values.astype('datetime64[ns]')
+                starts = np.searchsorted(
+                    times, lefts.values.astype('datetime64[ns]'), side='left')
+                ends = np.searchsorted(
+                    times, rights.values.astype('datetime64[ns]'), side='right')
+
+            if self.agg_method in SEGMENT_METHODS:
+                values = raw.values if store is None else store.padded_values()
+                aggregated = SEGMENT_METHODS[self.agg_method](
+                    np.asarray(values, dtype=np.float64), starts, ends)
+            else:
+                aggregated = np.full(len(lefts), nan)
+                for i, (s, e) in enumerate(zip(starts, ends)):
+                    d = raw.iloc[s:e].dropna()
+                    if len(d) >= 1:
+                        aggregated[i] = a(d)
 
             # remove nans
-            self.data = self.data.dropna()
+            self.data = pd.Series(
+                aggregated, index=lefts.values, dtype='float64').dropna()
             self.data.index = list(map(convert_to_water_year, self.data.index))
 
             # Convert to any new units
@@ -107,6 +147,12 @@ class ResampledDataset:
             if isinstance(self.data, pd.DataFrame):
                 self.data = self.data.iloc[:, 0]
 
+            method = app.preprocessing_methods[self.preprocessing]
+            params = None
+            if len(signature(method).parameters) > 1 and hasattr(self, 'params'):
+                params = self.params
+            RESAMPLE_MEMO.put(key, self.data, params)
+
             return
         else:
             print("did not resample")
@@ -457,6 +503,7 @@ class ModelConfigurations(QAbstractListModel):
         self.beginRemoveRows(QModelIndex(), idx, idx)
         self.removeRow(idx)
         self.endRemoveRows()
+        app.training_cache.discard(configuration.guid)
         self.dataChanged.emit(self.index(0), self.index(self.rowCount()))
 
         return
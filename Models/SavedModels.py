@@ -1,5 +1,6 @@
 import pickle
 import uuid
+from itertools import count
 
 import numpy as np
 import pandas as pd
@@ -79,16 +80,14 @@ class Model:
         return
 
     def __rich_text__(self):
-        if self.forecasts.forecasts.empty:
+        years = self.forecasts.years()
+        if not years:
             fcsts = [('-', "<td class='big'>no forecasts yet...</td>"),
                      ('', '<td></td>'), ('', '<td></td>')]
         else:
             fcsts = [('-', "<td class='big'>no forecasts yet...</td>"),
                      ('', '<td></td>'), ('', '<td></td>')]
-            years = list(self.forecasts.forecasts.index.get_level_values(0).unique())
-            years.sort()
-            years.reverse()
-            for i, year in enumerate(years[:3]):
+            for i, year in enumerate(years[::-1][:3]):
                 _10, _50, _90 = self.forecasts.get_10_50_90(year)
                 low, normal, high = np.quantile(self.predictand.data.values,
                                                 [0.3, 0.5, 0.7])
@@ -115,57 +114,164 @@ class Model:
         return content
 
 
-class ForecastList(object):
+# Forecast list versions. A ForecastList gets a new version whenever its
+# forecasts change, so that a save can tell which saved models changed.
+FORECAST_VERSIONS = count(1)
+
+# The exceedance probabilities that every forecast is generated for
+EXCEEDANCES = np.round(np.arange(0.01, 1, 0.0025), 4)
+
+# Positions of the 10%, 30%, 50%, 70% and 90% exceedances in EXCEEDANCES
+_10, _30, _50, _70, _90 = np.searchsorted(EXCEEDANCES, [0.1, 0.3, 0.5, 0.7, 0.9])
 
-    def __init__(self):
 
-        self.forecasts = pd.DataFrame(
-            index=pd.MultiIndex(
-                levels=[[], []],
-                codes=[[], []],
-                names=['Year', 'Exceedance']
-            ),
-            columns=['Value']
-        )
+class ForecastList(object):
+    """The forecasts of a saved model: a value for each exceedance probability
+    of each forecast year.
+
+    "values" maps each forecast year to its values, an array with a value for
+    each of EXCEEDANCES. Forecasts for other exceedances (from older forecast
+    files) are kept as a Series indexed by exceedance instead.
+
+    The forecasts of a model opened from a forecast file are read from the
+    file as they're used. 'years' are the forecast years still in the file,
+    and 'reader.read(year)' reads the values of one of them (as a Series
+    indexed by exceedance).
+    """
+
+    def __init__(self, years=None, reader=None):
+
+        self.values = {}
+        self.unread_years = set(years or [])
+        self.reader = reader
+        self.version = next(FORECAST_VERSIONS)
+
+    def __getstate__(self):
+        self.read_all()
+        state = self.__dict__.copy()
+        state['reader'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.version = next(FORECAST_VERSIONS)
+
+    @staticmethod
+    def year_values(values):
+        """Returns a year's values (a Series indexed by exceedance) as they're
+        kept in "values"."""
+
+        values = values.sort_index()
+        exceedances = values.index.values.astype(np.float64)
+        if (len(exceedances) == len(EXCEEDANCES)
+                and np.allclose(exceedances, EXCEEDANCES, rtol=0, atol=1e-9)):
+            return values.values.astype(np.float64)
+        return values.astype(np.float64)
+
+    @property
+    def forecasts(self):
+        """All of the forecasts, as a (Year, Exceedance) x 'Value' DataFrame."""
+
+        years, exceedances, values = self.arrays()
+        return pd.DataFrame(
+            index=pd.MultiIndex.from_arrays([years, exceedances],
+                                            names=['Year', 'Exceedance']),
+            data=values, columns=['Value'])
+
+    @forecasts.setter
+    def forecasts(self, forecasts):
+        self.values = {}
+        if len(forecasts):
+            values = forecasts['Value']
+            for year, year_values in values.groupby(level=0, sort=True):
+                self.values[year] = self.year_values(year_values.droplevel(0))
+        self.unread_years = set()
+        self.reader = None
+        self.version = next(FORECAST_VERSIONS)
+
+    def arrays(self):
+        """Returns every forecast as (year, exceedance, value) arrays, sorted
+        by year and exceedance."""
+
+        self.read_all()
+        years, exceedances, values = [], [], []
+        for year in sorted(self.values):
+            year_values = self.values[year]
+            if isinstance(year_values, pd.Series):
+                exceedances.append(year_values.index.values.astype(np.float64))
+                year_values = year_values.values
+            else:
+                exceedances.append(EXCEEDANCES)
+            years.append(np.full(len(year_values), year, dtype=np.int64))
+            values.append(year_values)
+
+        if not years:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64),
+                    np.empty(0, dtype=np.float64))
+        return np.concatenate(years), np.concatenate(exceedances), np.concatenate(values)
+
+    def read_years(self, years):
+        """Reads the forecasts for any of 'years' that are still in the file."""
+
+        for year in sorted(self.unread_years.intersection(years)):
+            self.values[year] = self.year_values(self.reader.read(year))
+            self.unread_years.discard(year)
+        if not self.unread_years:
+            self.reader = None
+
+    def read_all(self):
+        """Reads every forecast that's still in the file."""
+        self.read_years(self.unread_years)
+
+    def years(self):
+        """Returns the forecast years (sorted)."""
+        return sorted(self.unread_years.union(self.values))
+
+    def __contains__(self, year):
+        return year in self.unread_years or year in self.values
+
+    def get(self, year):
+        """Returns the forecast values for 'year' (indexed by exceedance), or
+        None if there's no forecast for 'year'."""
+
+        self.read_years([year])
+        values = self.values.get(year)
+        if values is None or isinstance(values, pd.Series):
+            return values
+        return pd.Series(values, index=pd.Index(EXCEEDANCES, name='Exceedance'),
+                         name='Value')
 
     def set_forecasts_1_99(self, year, values):
-        idx = [(year, round(i, 4)) for i in np.arange(0.01, 1, 0.0025)]
-        data = pd.DataFrame(
-            index=pd.MultiIndex.from_tuples(idx, names=('Year', 'Exceedance')),
-            columns=['Value'],
-            data=values
-        )
-        self.forecasts = pd.concat([self.forecasts, data])
-        self.forecasts = self.forecasts[~self.forecasts.index.duplicated(keep='last')]
-        self.forecasts.sort_index(inplace=True)
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) != len(EXCEEDANCES):
+            raise ValueError(f'Expected {len(EXCEEDANCES)} forecast values, '
+                             f'got {len(values)}')
+        self.unread_years.discard(year)
+        self.values[year] = values
+        self.version = next(FORECAST_VERSIONS)
+
+    def quantiles(self, year, positions, exceedances):
+        """The values at 'exceedances' (at 'positions' in EXCEEDANCES) for
+        'year', or NaN if there's no forecast for 'year'."""
+
+        self.read_years([year])
+        values = self.values.get(year)
+        if values is None:
+            return tuple(np.nan for _ in exceedances)
+        if not isinstance(values, pd.Series):
+            return tuple(float(values[i]) for i in positions)
+        if values.empty:
+            return tuple(np.nan for _ in exceedances)
+        if all(e in values.index for e in exceedances):
+            return tuple(float(values.loc[e]) for e in exceedances)
+        return tuple(np.quantile(values, exceedances))
 
     def get_10_50_90(self, year):
-        if year in self.forecasts.index.get_level_values(0):
-            values = self.forecasts.loc[(year), 'Value']
-            if values.empty:
-                return np.nan, np.nan, np.nan
-            if 0.1 in values.index and 0.9 in values.index and 0.5 in values.index:
-                return float(values.loc[0.1]), float(values.loc[0.5]), float(
-                    values.loc[0.9])
-            else:
-                q = np.quantile(values, [0.1, 0.5, 0.9])
-                return q[0], q[1], q[2]
-        else:
-            return np.nan, np.nan, np.nan
+        return self.quantiles(year, [_10, _50, _90], [0.1, 0.5, 0.9])
 
     def get_10_30_50_70_90(self, year):
-        if year in self.forecasts.index.get_level_values(0):
-            values = self.forecasts.loc[(year), 'Value']
-            if values.empty:
-                return np.nan, np.nan, np.nan, np.nan, np.nan
-            if 0.1 in values.index and 0.3 in values.index and 0.9 in values.index and 0.5 in values.index and 0.7 in values.index:
-                return float(values.loc[0.1]), float(values.loc[0.3]), float(
-                    values.loc[0.5]), float(values.loc[0.7]), float(values.loc[0.9])
-            else:
-                q = np.quantile(values, [0.1, 0.3, 0.5, 0.7, 0.9])
-                return q[0], q[1], q[2], q[3], q[4]
-        else:
-            return np.nan, np.nan, np.nan
+        return self.quantiles(year, [_10, _30, _50, _70, _90],
+                              [0.1, 0.3, 0.5, 0.7, 0.9])
 
 
 class SavedModelList(QAbstractListModel):
@@ -183,8 +289,7 @@ class SavedModelList(QAbstractListModel):
     def list_forecast_years(self):
         years = []
         for m in self.saved_models:
-            y = list(set(m.forecasts.forecasts.index.get_level_values(0)))
-            years = years + y
+            years = years + m.forecasts.years()
         years.sort()
         return list(set(years))
 
@@ -287,6 +392,7 @@ class SavedModelList(QAbstractListModel):
             self.removeRow(idx)
             self.endRemoveRows()
 
+        app.training_cache.discard(model.guid)
         self.dataChanged.emit(self.index(0), self.index(self.rowCount()))
         app.SMMV.update_combo_box(None, None)
 
@@ -1,6 +1,7 @@
 from collections import OrderedDict
 
 import numpy as np
+from numba import jit
 
 
 def acc_cfs_kaf(s):
@@ -38,3 +39,118 @@ METHODS = OrderedDict([
     ('FIRST', first),
     ('LAST', last)
 ])
+
+
+# Compiled forms of the methods above, which aggregate many windows in one
+# call. Each takes an array of values plus the start and end offsets of every
+# window (values[start:end]), skips NaNs, and returns one aggregate per window
+# (NaN for windows without any values). The windows may be in any order, and
+# may come from several series concatenated into one array.
+
+@jit(nopython=True, cache=True)
+def segment_sum(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        total = 0.0
+        count = 0
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]):
+                total += values[j]
+                count += 1
+        if count:
+            out[i] = total
+    return out
+
+
+def segment_acc_cfs_kaf(values, starts, ends):
+    return segment_sum(values, starts, ends) * 86400 / 43560000
+
+
+def segment_acc_cms_mcm(values, starts, ends):
+    return segment_sum(values, starts, ends) * 0.0864
+
+
+@jit(nopython=True, cache=True)
+def segment_mean(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        total = 0.0
+        count = 0
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]):
+                total += values[j]
+                count += 1
+        if count:
+            out[i] = total / count
+    return out
+
+
+@jit(nopython=True, cache=True)
+def segment_max(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]) and not values[j] <= out[i]:
+                out[i] = values[j]
+    return out
+
+
+@jit(nopython=True, cache=True)
+def segment_min(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]) and not values[j] >= out[i]:
+                out[i] = values[j]
+    return out
+
+
+@jit(nopython=True, cache=True)
+def segment_median(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    buffer = np.empty(values.shape[0])
+    for i in range(len(starts)):
+        count = 0
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]):
+                buffer[count] = values[j]
+                count += 1
+        if count:
+            ordered = np.sort(buffer[:count])
+            out[i] = (ordered[(count - 1) // 2] + ordered[count // 2]) / 2
+    return out
+
+
+@jit(nopython=True, cache=True)
+def segment_first(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        for j in range(starts[i], ends[i]):
+            if not np.isnan(values[j]):
+                out[i] = values[j]
+                break
+    return out
+
+
+@jit(nopython=True, cache=True)
+def segment_last(values, starts, ends):
+    out = np.full(len(starts), np.nan)
+    for i in range(len(starts)):
+        for j in range(ends[i] - 1, starts[i] - 1, -1):
+            if not np.isnan(values[j]):
+                out[i] = values[j]
+                break
+    return out
+
+
+SEGMENT_METHODS = OrderedDict([
+    ('ACCUMULATION', segment_sum),
+    ('ACCUMULATION (CFS to KAF)', segment_acc_cfs_kaf),
+    ('ACCUMULATION (CMS to MCM)', segment_acc_cms_mcm),
+    ('AVERAGE', segment_mean),
+    ('MAXIMUM', segment_max),
+    ('MINIMUM', segment_min),
+    ('MEDIAN', segment_median),
+    ('FIRST', segment_first),
+    ('LAST', segment_last)
+])
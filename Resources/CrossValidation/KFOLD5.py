@@ -3,7 +3,7 @@ from numpy import full, cumsum
 
 
 # 5-FOLD CROSS VALIDATION, repeated 10 times
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def yield_samples(total):
     ret = []
 
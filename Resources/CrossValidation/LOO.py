@@ -1,9 +1,10 @@
+import numpy as np
 from numba import jit
 from numpy import full, cumsum
 
 
 # LEAVE ONE OUT CROSS VALIDATION, repeated 1 times
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def yield_samples(total):
     ret = []
     indices = list(range(total))
@@ -19,3 +20,35 @@ def yield_samples(total):
             idx = [True for r in range(folds_c[-2])] + [False for r in range(f)]
         ret.append([idx[i] for i in indices])
     return ret
+
+
+# Leverage above which the leave-one-out shortcut is not used, since the
+# prediction for that row would be dominated by round-off.
+MAX_LEVERAGE = 1 - 1e-6
+
+
+def press_predict(x, y, a_inv, beta):
+    """Leave-one-out predictions from a single least squares fit.
+
+    For a least squares fit, the prediction for row i from a model fitted
+    without row i is y_i - e_i / (1 - h_ii), where e_i is the full-fit
+    residual and h_ii the diagonal of the hat matrix X (X'X)^-1 X'. Works on
+    stacks of fits.
+
+    args:
+      x (`np.ndarray`) - (... x rows x coefficients) design matrices
+      y (`np.ndarray`) - predictand
+      a_inv (`np.ndarray`) - (... x coefficients x coefficients) inverse of X'X
+      beta (`np.ndarray`) - (... x coefficients) full-fit coefficients
+
+    returns:
+      y_p (`np.ndarray`) - (... x rows) leave-one-out predictions, in row order
+      leverage (`np.ndarray`) - (... x rows) hat matrix diagonal
+    """
+
+    leverage = np.einsum('...nk,...kj,...nj->...n', x, a_inv, x)
+    residuals = y - np.einsum('...nk,...k->...n', x, beta)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y_p = y - residuals / (1 - leverage)
+
+    return y_p, leverage
@@ -1,4 +1,7 @@
 from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
 
 from . import KFOLD10, KFOLD5, LOO
 
@@ -9,3 +12,59 @@ CROSS_VALIDATION = OrderedDict(
         ('LEAVE ONE OUT', LOO)
     ]
 )
+
+
+class FoldPlan:
+    """The train and test row indices of every fold of a cross-validation
+    scheme for a given number of samples.
+
+    Iterating over a FoldPlan yields (train, test) pairs of int32 index arrays.
+    The arrays are shared between everyone using the plan, so they are
+    read-only.
+
+    Class Variables:
+    "train" : list of int32 arrays of the training rows in each fold
+    "test" : list of int32 arrays of the testing rows in each fold
+    "train_mask" : folds x samples boolean array of the training rows
+    "order" : the test rows of every fold, concatenated in fold order. This is
+              the order of the cross-validated predictions.
+    "fold_of_row" : the fold that each entry of "order" is tested in
+    "starts" : where each fold's predictions begin in "order"
+    """
+
+    def __init__(self, scheme, total):
+
+        samples = CROSS_VALIDATION[scheme].yield_samples(total)
+        self.train_mask = np.array(samples, dtype=bool).reshape(len(samples), total)
+        self.train = [np.flatnonzero(m).astype(np.int32) for m in self.train_mask]
+        self.test = [np.flatnonzero(~m).astype(np.int32) for m in self.train_mask]
+        self.order = np.concatenate(self.test + [np.array([], dtype=np.int32)])
+        self.fold_of_row = np.repeat(
+            np.arange(len(self.test)), [len(t) for t in self.test])
+        self.starts = np.concatenate(
+            ([0], np.cumsum([len(t) for t in self.test])))[:-1].astype(np.int64)
+
+        for array in [self.train_mask, self.order, self.fold_of_row, self.starts,
+                      *self.train, *self.test]:
+            array.flags.writeable = False
+
+    def __iter__(self):
+        return zip(self.train, self.test)
+
+    def prediction_buffer(self, out=None):
+        """Returns an array to hold the cross-validated predictions: the
+        leading part of 'out' if it is given, otherwise a new array."""
+
+        if out is None:
+            return np.empty(len(self.order))
+        return out[:len(self.order)]
+
+    def __len__(self):
+        return len(self.train)
+
+
+@lru_cache(maxsize=256)
+def get_fold_plan(scheme, total):
+    """Returns the (cached) FoldPlan for the scheme named 'scheme' (a key of
+    CROSS_VALIDATION) and 'total' samples."""
+    return FoldPlan(scheme, total)
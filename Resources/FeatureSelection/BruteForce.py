@@ -4,6 +4,8 @@ from PySide6.QtWidgets import QApplication
 from numba import jit
 from numpy import inf
 
+from .GenomeSet import GenomeSet
+
 app = QApplication.instance()
 
 
@@ -21,18 +23,27 @@ class BruteForce:
         self.num_forced = sum([int(f) for f in self.forcings])
         self.forcings = int(''.join(self.forcings), base=2)
         self.total = (2 ** self.num_predictors - self.num_forced) - 1
-        self.completed = []
+        self.completed = GenomeSet(self.num_predictors, dense=True)
         self.current_index = 0
         self.running = True
         self.progress = 0
         self.num_possible = (2 ** (self.num_predictors - self.num_forced)) - 1
 
+        # In Gray-code order only the free (non-forced) predictors are
+        # enumerated, and each model differs from the last by one predictor
+        self.gray_code = app.settings.get('brute_force_gray_code', True)
+        self.free_bits = [b for b in range(self.num_predictors)
+                          if not self.forcings & (1 << b)]
+        self.num_steps = (2 ** len(self.free_bits) if self.gray_code
+                          else 2 ** self.num_predictors)
+
     def finish(self):
 
         num_evaluated = len(self.completed)
 
         print(
             f"Evaluated {num_evaluated} out of {self.num_possible + 1} possible models")
+        print(f"Tracked {self.completed}")
         self.running = False
 
     @staticmethod
@@ -40,19 +51,33 @@ class BruteForce:
     def convert_int_to_array(num, num_p):
         return list([bool(num & (1 << n)) for n in range(num_p)])[::-1]
 
+    def model_at(self, index):
+        """Returns the model handed out at step 'index' of the enumeration."""
+
+        if not self.gray_code:
+            return index | self.forcings
+
+        gray = index ^ (index >> 1)
+        model = self.forcings
+        for i, b in enumerate(self.free_bits):
+            if gray & (1 << i):
+                model |= 1 << b
+
+        return model
+
     def next(self, last_score=inf, score_type=0):
 
         if not self.running:
             return -1
-        if self.current_index < 2 ** self.num_predictors:
-            self.progress = int(100 * self.current_index / 2 ** self.num_predictors)
-            model = (self.current_index | self.forcings)
+        if self.current_index < self.num_steps:
+            self.progress = int(100 * self.current_index / self.num_steps)
+            model = self.model_at(self.current_index)
             if model in self.completed:
                 self.current_index += 1
                 return self.next()
             else:
                 self.current_index += 1
-                self.completed.append(model)
+                self.completed.add(model)
                 return model
         else:
             self.progress = 100
@@ -73,3 +98,27 @@ class BruteForce:
         #     self.current_index += 1
         #     self.completed.append(model)
         #     return model
+
+    def next_batch(self, last_scores=None, score_type=0, size=1):
+        """Returns up to 'size' models at once, for evaluating in parallel. In
+        Gray-code order the batch is a chain of single-predictor changes.
+
+        Brute force does not depend on the scores of previous models, so
+        'last_scores' is ignored. Returns an empty list once all the models
+        have been handed out.
+        """
+
+        batch = []
+        while self.running and len(batch) < size:
+            if self.current_index < self.num_steps:
+                model = self.model_at(self.current_index)
+                self.current_index += 1
+                if model not in self.completed:
+                    self.completed.add(model)
+                    batch.append(model)
+                self.progress = int(100 * self.current_index / self.num_steps)
+            else:
+                self.progress = 100
+                self.finish()
+
+        return batch
@@ -0,0 +1,63 @@
+# SET OF EVALUATED PREDICTOR COMBINATIONS
+# KEEPS TRACK OF WHICH GENOMES A FEATURE SELECTOR HAS ALREADY HANDED OUT
+import sys
+
+# Largest number of predictors for which a packed bit array (one bit for
+# every possible genome, 2^30 bits = 128 MiB) is used.
+DENSE_MAX_PREDICTORS = 30
+
+
+class GenomeSet:
+    """Set of genomes, where a genome is a predictor combination encoded as an
+    integer.
+
+    Exhaustive searches use a packed bit array with one bit per possible
+    genome, and sparse searches use a hashed set.
+    """
+
+    def __init__(self, num_predictors, dense=False):
+
+        self.dense = dense and num_predictors <= DENSE_MAX_PREDICTORS
+        if self.dense:
+            self.bits = bytearray(((1 << num_predictors) + 7) // 8)
+            self.count = 0
+        else:
+            self.genomes = set()
+
+    def add(self, genome):
+
+        genome = int(genome)
+        if self.dense:
+            byte, bit = genome >> 3, 1 << (genome & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                self.count += 1
+        else:
+            self.genomes.add(genome)
+
+    def __contains__(self, genome):
+
+        genome = int(genome)
+        if self.dense:
+            return bool(self.bits[genome >> 3] & (1 << (genome & 7)))
+        return genome in self.genomes
+
+    def __len__(self):
+
+        if self.dense:
+            return self.count
+        return len(self.genomes)
+
+    @property
+    def nbytes(self):
+        """Approximate memory used to track the genomes."""
+
+        if self.dense:
+            return sys.getsizeof(self.bits)
+        return sys.getsizeof(self.genomes) + sum(
+            sys.getsizeof(g) for g in self.genomes)
+
+    def __str__(self):
+
+        kind = 'bit array' if self.dense else 'hashed set'
+        return f'{len(self)} genomes in a {kind} using {self.nbytes / 1024:.1f} KiB'
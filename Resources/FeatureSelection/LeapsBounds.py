@@ -0,0 +1,364 @@
+# LEAPS AND BOUNDS SELECTION
+# BRANCH AND BOUND SEARCH FOR THE BEST SUBSETS OF EACH SIZE (FURNIVAL & WILSON)
+from time import time
+
+import numpy as np
+from PySide6.QtWidgets import QApplication
+from numba import jit
+from numpy import inf
+
+from .GenomeSet import GenomeSet
+
+app = QApplication.instance()
+
+# Seconds of searching done per call to `next` / `next_batch`, so that the
+# model generator can keep the interface responsive and check for aborts.
+SEARCH_SLICE = 0.25
+
+# Number of subsets visited between checks of the time
+NODES_PER_CHECK = 20000
+
+# Smallest pivot (relative to the column's sum of squares) for a subset's
+# least squares fit to be treated as non-singular.
+MIN_PIVOT = 1e-10
+
+
+@jit(nopython=True, cache=True)
+def subset_factor(gram, offset, subset):
+    """Cholesky factor of the Gram matrix of [fixed columns, subset, y], where
+    'offset' is the number of fixed columns and 'subset' holds indices of the
+    columns after them. Singular fits get NaN pivots."""
+
+    cols = np.empty(offset + len(subset) + 1, dtype=np.int64)
+    cols[:offset] = np.arange(offset)
+    cols[offset:-1] = subset + offset
+    cols[-1] = gram.shape[0] - 1
+
+    k = len(cols)
+    l = np.zeros((k, k))
+    for i in range(k):
+        for j in range(i + 1):
+            s = gram[cols[i], cols[j]]
+            for q in range(j):
+                s -= l[i, q] * l[j, q]
+            if i == j:
+                l[i, i] = np.sqrt(s) if s > 0 else np.nan
+            else:
+                l[i, j] = s / l[j, j]
+
+    return l
+
+
+@jit(nopython=True, cache=True)
+def drop_column(l, c):
+    """Removes column 'c' from the Cholesky factor 'l', restoring the triangle
+    with Givens rotations. The last diagonal entry of the result is the root
+    of the residual sum of squares when the last column is the predictand."""
+
+    k = l.shape[0]
+    r = np.empty((k - 1, k))
+    r[:c] = l[:c]
+    r[c:] = l[c + 1:]
+    for i in range(c, k - 1):
+        a = r[i, i]
+        b = r[i, i + 1]
+        h = np.hypot(a, b)
+        cs = a / h
+        sn = b / h
+        for row in range(i, k - 1):
+            ri = r[row, i]
+            rj = r[row, i + 1]
+            r[row, i] = cs * ri + sn * rj
+            r[row, i + 1] = cs * rj - sn * ri
+
+    return r[:, :k - 1].copy()
+
+
+@jit(nopython=True, cache=True)
+def factor_rss(l, y_ss):
+    """Residual sum of squares from a factor, or 0 (which keeps the bound
+    valid) if any pivot is too small to trust."""
+
+    k = l.shape[0]
+    for i in range(k - 1):
+        if not l[i, i] * l[i, i] >= MIN_PIVOT:
+            return 0.0
+    return l[k - 1, k - 1] * l[k - 1, k - 1] * y_ss
+
+
+@jit(nopython=True, cache=True)
+def branch_and_bound(gram, y_ss, offset, stack_sets, stack_len, stack_start,
+                     stack_l, stack_ok, top, best_rss, best_sets, max_nodes):
+    """Runs the branch and bound for up to 'max_nodes' subsets.
+
+    Each node on the stack is a subset (indices into the free predictors)
+    plus the position from which its predictors may still be dropped, with
+    the Cholesky factor of its fit. Every subset below a node contains the
+    predictors before that position, so its residual sum of squares is no
+    lower than the node's own, and the node is pruned once that bound can't
+    beat the best subsets of any size below it.
+
+    The best subsets of each size are kept in 'best_rss' / 'best_sets'
+    (sizes x subsets, as bit masks of the free predictors). Returns the new
+    top of the stack (0 once the search is complete) and the number of
+    subsets visited.
+    """
+
+    nodes = 0
+    while top > 0 and nodes < max_nodes:
+
+        top -= 1
+        m = stack_len[top]
+        start = stack_start[top]
+        parent = stack_sets[top, :m].copy()
+        l = stack_l[top, :offset + m + 1, :offset + m + 1].copy()
+        ok = stack_ok[top]
+
+        for j in range(m - 1, start - 1, -1):
+            child = np.empty(m - 1, dtype=np.int64)
+            child[:j] = parent[:j]
+            child[j:] = parent[j + 1:]
+            if ok:
+                child_l = drop_column(l, offset + j)
+            else:
+                child_l = subset_factor(gram, offset, child)
+            rss = factor_rss(child_l, y_ss)
+            nodes += 1
+
+            # Keep the subset if it is one of the best of its size
+            size = m - 1
+            if size > 0 and rss > 0:
+                worst = np.argmax(best_rss[size])
+                if rss < best_rss[size, worst]:
+                    best_rss[size, worst] = rss
+                    mask = 0
+                    for c in child:
+                        mask |= 1 << c
+                    best_sets[size, worst] = mask
+
+            bound = 0.0
+            for s in range(max(j, 1), size):
+                bound = max(bound, best_rss[s].max())
+            if rss >= bound:
+                continue
+
+            stack_sets[top, :size] = child
+            stack_len[top] = size
+            stack_start[top] = j
+            stack_l[top, :offset + size + 1, :offset + size + 1] = child_l
+            stack_ok[top] = rss > 0
+            top += 1
+
+    return top, nodes
+
+
+class LeapsBounds:
+    NAME = "Leaps and Bounds Selection"
+    DESCR = ("Finds the subsets of each size with the lowest in-sample residual "
+             "sum of squares by branch and bound, and cross-validates only those.")
+
+    def __init__(self, thread=None, configuration=None, num_predictors=None):
+
+        self.config = configuration
+        self.thread = thread
+        self.num_predictors = len(self.config.predictor_pool)
+
+        # Keep a record of which predictors are to be forced into all models.
+        self.forcings = ['0' if not p.forced else '1' for p in
+                         self.config.predictor_pool.predictors]
+        self.num_forced = sum([int(f) for f in self.forcings])
+        self.forcings = int(''.join(self.forcings), base=2)
+
+        # Number of subsets of each size kept for cross-validation
+        self.subsets_per_size = app.settings.get('leaps_and_bounds_subsets', 10)
+
+        # Feature selection process info
+        self.completed = GenomeSet(self.num_predictors, dense=False)
+        self.progress = 0
+        self.running = False
+        self.num_possible = (2 ** (self.num_predictors - self.num_forced)) - 1
+
+        # Feature selection timer.
+        self.timeout_seconds = app.settings['model_search_time_limit'] * 60
+
+        self.searching = True
+        self.survivors = []
+        self.num_survivors = 0
+        self.nodes = 0
+
+        # The collated training data is kept by the model generator
+        self.setup_search(thread.data)
+
+        return
+
+    def setup_search(self, data):
+        """Builds the Gram matrix of the in-sample fits from the collated
+        training data (predictors in pool order, predictand last), and puts
+        the full subset on the search stack.
+
+        The bounds are computed on the years that the predictand and every
+        usable predictor cover, so that the residual sum of squares can only
+        fall as predictors are added.
+        """
+
+        usable = ~np.isnan(data[:, :-1]).all(axis=0)
+        free = [c for c in range(self.num_predictors) if usable[c]
+                and not self.forcings & self.column_bit(c)]
+        forced = [c for c in range(self.num_predictors) if usable[c]
+                  and self.forcings & self.column_bit(c)]
+        rows = ~np.isnan(data[:, usable.tolist() + [True]]).any(axis=1)
+
+        # Columns are [1, forced, free, y], equilibrated
+        z = np.column_stack((np.ones(rows.sum()), data[rows][:, forced + free],
+                             data[rows, -1]))
+        gram = z.T.dot(z)
+        scale = np.sqrt(np.diagonal(gram))
+        scale[scale == 0] = 1
+        self.gram = gram / scale[:, None] / scale[None, :]
+        self.y_ss = gram[-1, -1]
+        self.offset = len(forced) + 1
+
+        # Order the free predictors from the one whose removal costs the most
+        # to the one that costs the least, so that the largest subtrees get
+        # the highest bounds.
+        num_free = len(free)
+        full = np.arange(num_free)
+        increase = [factor_rss(subset_factor(
+            self.gram, self.offset, np.delete(full, i)), self.y_ss)
+            for i in range(num_free)]
+        order = np.argsort(increase, kind='stable')[::-1]
+        self.free_columns = np.array(free, dtype=np.int64)[order]
+        cols = np.concatenate((np.arange(self.offset), order + self.offset, [-1]))
+        self.gram = np.ascontiguousarray(self.gram[np.ix_(cols, cols)])
+
+        # Depth-first, so the stack never holds more than one set of
+        # siblings per level
+        depth = num_free * (num_free + 1) // 2 + 1
+        k = self.offset + num_free + 1
+        self.stack_sets = np.zeros((depth, num_free), dtype=np.int64)
+        self.stack_len = np.zeros(depth, dtype=np.int64)
+        self.stack_start = np.zeros(depth, dtype=np.int64)
+        self.stack_l = np.zeros((depth, k, k))
+        self.stack_ok = np.zeros(depth, dtype=np.bool_)
+        self.best_rss = np.full((num_free + 1, self.subsets_per_size), inf)
+        self.best_sets = np.zeros((num_free + 1, self.subsets_per_size),
+                                  dtype=np.int64)
+
+        l = subset_factor(self.gram, self.offset, full)
+        rss = factor_rss(l, self.y_ss)
+        if num_free and rss > 0:
+            self.best_rss[num_free, 0] = rss
+            self.best_sets[num_free, 0] = (1 << num_free) - 1
+        self.stack_sets[0] = full
+        self.stack_len[0] = num_free
+        self.stack_l[0] = l
+        self.stack_ok[0] = rss > 0
+        self.top = 1
+
+    @staticmethod
+    @jit(nopython=True, cache=True)
+    def convert_int_to_array(num, num_p):
+        return list([bool(num & (1 << n)) for n in range(num_p)])[::-1]
+
+    def column_bit(self, column):
+        """Genome bit of the predictor in column 'column' of the pool."""
+        return 1 << (self.num_predictors - 1 - column)
+
+    def genome(self, mask):
+        """Converts a bit mask of the free predictors to a genome."""
+
+        genome = self.forcings
+        for i, c in enumerate(self.free_columns):
+            if mask & (1 << i):
+                genome |= self.column_bit(int(c))
+
+        return genome
+
+    def search(self, seconds):
+        """Runs the branch and bound for up to 'seconds', then lines up the
+        surviving subsets once it is complete or the time limit is up."""
+
+        stop = time() + seconds
+        while self.top and time() < stop:
+            self.top, nodes = branch_and_bound(
+                self.gram, self.y_ss, self.offset, self.stack_sets,
+                self.stack_len, self.stack_start, self.stack_l, self.stack_ok,
+                self.top, self.best_rss, self.best_sets, NODES_PER_CHECK)
+            self.nodes += nodes
+
+        if not self.top or time() - self.time > self.timeout_seconds:
+            self.searching = False
+            self.top = 0
+            kept = np.isfinite(self.best_rss)
+            self.survivors = [self.genome(int(mask))
+                              for mask in self.best_sets[kept]]
+            self.num_survivors = len(self.survivors)
+            print(f'Feature Selector: searched {self.nodes} subsets, '
+                  f'cross-validating {self.num_survivors}')
+
+    def start(self, score_type=0):
+        """Starts the feature selector's timer."""
+
+        print(f'Feature Selector: STARTING TIMER for {self.timeout_seconds} seconds')
+        self.time = time()
+        self.running = True
+
+    def finish(self):
+
+        num_evaluated = len(self.completed)
+
+        print(f"Evaluated {num_evaluated} out of {self.num_possible} possible models")
+        print(f"Tracked {self.completed}")
+        self.progress = 100
+        self.running = False
+
+    def update_progress(self):
+
+        if self.searching:
+            elapsed = time() - self.time
+            self.progress = min(99, int(100 * elapsed / self.timeout_seconds))
+        elif self.num_survivors:
+            handed_out = self.num_survivors - len(self.survivors)
+            self.progress = max(
+                self.progress, int(100 * handed_out / self.num_survivors))
+
+    def next(self, last_score=None, score_type=0):
+
+        batch = self.next_batch(size=1)
+        if not batch:
+            return -1
+
+        return batch[0]
+
+    def next_batch(self, last_scores=None, score_type=0, size=1):
+        """Returns up to 'size' of the surviving subsets.
+
+        While the branch and bound is still running this returns [-1] (no
+        model) after each slice of searching. The scores are not used, since
+        the subsets are chosen on their in-sample fit. Returns an empty list
+        once every surviving subset has been handed out.
+        """
+
+        if not self.running:
+            if self.progress == 100:
+                return []
+            self.start(score_type)
+
+        if self.searching:
+            self.search(SEARCH_SLICE)
+            self.update_progress()
+            if self.searching:
+                return [-1]
+
+        batch = []
+        while self.survivors and len(batch) < size:
+            genome = self.survivors.pop(0)
+            if genome not in self.completed:
+                self.completed.add(genome)
+                batch.append(genome)
+        self.update_progress()
+
+        if not batch:
+            self.finish()
+
+        return batch
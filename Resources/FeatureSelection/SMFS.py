@@ -7,6 +7,8 @@ from PySide6.QtWidgets import QApplication
 from numba import jit
 from numpy import inf, random, int64
 
+from .GenomeSet import GenomeSet
+
 app = QApplication.instance()
 
 
@@ -34,7 +36,7 @@ class SMFS:
         self.combo_1_current_idx = 0
 
         # Feature selection process info
-        self.completed = []
+        self.completed = GenomeSet(self.num_predictors, dense=False)
         self.progress = 0
         self.running = False
 
@@ -48,6 +50,10 @@ class SMFS:
         self.first_randomizer = True
         self.rec_cnt = 0
 
+        # The models handed out by `next_batch`, by the bit they toggle
+        self.batch_idx = []
+        self.phase_started = False
+
         self.num_possible = (2 ** (self.num_predictors - self.num_forced)) - 1
 
         return
@@ -57,6 +63,8 @@ class SMFS:
         num_evaluated = len(self.completed)
 
         print(f"Evaluated {num_evaluated} out of {self.num_possible} possible models")
+        print(f"Tracked {self.completed}")
+        self.progress = 100
         self.running = False
 
     def randomize(self):
@@ -78,35 +86,21 @@ class SMFS:
     def convert_int_to_array(num, num_p):
         return list([bool(num & (1 << n)) for n in range(num_p)])[::-1]
 
-    def next(self, last_score=None, score_type=0, recurs=False):
-
-        self.rec_cnt += recurs
-        if not self.rec_cnt:
-            self.rec_cnt = 0
-        if self.rec_cnt > self.num_predictors:
-            # print('recursion count exceeded')
-            self.randomize()
-            self.rec_cnt = 0
-            return -1
+    def start(self, score_type=0):
+        """Starts the feature selector's timer."""
 
-        # initialize the features selector with a start time.
-        if not self.running:
-            print(f'Feature Selector: STARTING TIMER for {self.timeout_seconds} seconds')
-            self.time = time()
-            self.running = True
-            if score_type == 0:
-                self.current_score_1 = inf
-            else:
-                self.current_score_1 = -inf
+        print(f'Feature Selector: STARTING TIMER for {self.timeout_seconds} seconds')
+        self.time = time()
+        self.running = True
+        if score_type == 0:
+            self.current_score_1 = inf
+        else:
+            self.current_score_1 = -inf
 
-        # If there's no 'last_score' set last_score to +/- inf.
-        if not last_score:
-            if score_type == 0:
-                last_score = inf
-            else:
-                last_score = -inf
+    def out_of_time(self):
+        """Updates the progress, and finishes the search (returning True) if the
+        time limit is up or nearly every model has been evaluated."""
 
-        # Check the elapsed time to see if we need to stop. Also update progress.
         elapsed = time() - self.time
         if len(self.timer_incs) > 0:
             if (elapsed > self.timer_incs[0]):
@@ -115,85 +109,162 @@ class SMFS:
         remaining = self.timeout_seconds - elapsed
         self.progress = min(100, int(100 * (elapsed / self.timeout_seconds)))
 
-        if len(self.completed) >= self.num_possible - 3:
-            self.finish()
-            return -1
-
-        if remaining < 0:
+        if len(self.completed) >= self.num_possible - 3 or remaining < 0:
             self.finish()
-            return -1
-
-        # Check if the last score beats the current score.
-        # if so, set the bext idx to the last idx
-        if score_type == 0 and (last_score < self.current_score_1):
-            self.current_score_1 = last_score
-            self.combo_1_best_idx = self.combo_1_current_idx - 1
+            return True
 
-        if score_type == 1 and (last_score > self.current_score_1):
-            self.current_score_1 = last_score
-            self.combo_1_best_idx = self.combo_1_current_idx - 1
+        return False
 
-        if not self.combo_1_current_idx == self.num_predictors:
+    def next(self, last_score=None, score_type=0, recurs=False):
 
-            if self.combo_1_status:  # Adding
-                if not (self.current_combo_1 & 2 ** self.combo_1_current_idx):
-                    combo = (self.current_combo_1 | 2 ** self.combo_1_current_idx)
-                    combo = (combo | self.forcings)
-                    if combo in self.completed:
-                        self.combo_1_current_idx += 1
-                        return self.next(last_score, score_type=score_type, recurs=True)
-                    self.combo_1_current_idx += 1
-                    self.completed.append(combo)
-                    return combo
+        # Each pass through this loop is one step of the selector. Steps that
+        # don't produce a new model (the bit is already set / unset, or the
+        # model was already evaluated) move on to the next step.
+        while True:
+
+            self.rec_cnt += recurs
+            if self.rec_cnt > self.num_predictors:
+                self.randomize()
+                self.rec_cnt = 0
+                return -1
+            recurs = True
+
+            # initialize the features selector with a start time.
+            if not self.running:
+                self.start(score_type)
+
+            # If there's no 'last_score' set last_score to +/- inf.
+            if not last_score:
+                if score_type == 0:
+                    last_score = inf
                 else:
-                    self.combo_1_current_idx += 1
-                    return self.next(last_score, score_type=score_type, recurs=True)
-
-            else:  # removing
-                if (self.current_combo_1 & 2 ** self.combo_1_current_idx):
+                    last_score = -inf
+
+            # Check the elapsed time to see if we need to stop. Also update progress.
+            if self.out_of_time():
+                return -1
+
+            # Check if the last score beats the current score.
+            # if so, set the bext idx to the last idx
+            if score_type == 0 and (last_score < self.current_score_1):
+                self.current_score_1 = last_score
+                self.combo_1_best_idx = self.combo_1_current_idx - 1
+
+            if score_type == 1 and (last_score > self.current_score_1):
+                self.current_score_1 = last_score
+                self.combo_1_best_idx = self.combo_1_current_idx - 1
+
+            if not self.combo_1_current_idx == self.num_predictors:
+
+                bit = 2 ** self.combo_1_current_idx
+                if self.combo_1_status:  # Adding
+                    applies = not (self.current_combo_1 & bit)
+                    combo = self.current_combo_1 | bit
+                else:  # removing
+                    applies = bool(self.current_combo_1 & bit)
                     combo = self.toggle_bit(self.current_combo_1,
                                             self.combo_1_current_idx)
-                    combo = (combo | self.forcings)
-                    if combo in self.completed:
-                        self.combo_1_current_idx += 1
-                        return self.next(last_score, score_type=score_type, recurs=True)
-                    self.combo_1_current_idx += 1
-                    self.completed.append(combo)
-                    return combo
-                else:
-                    self.combo_1_current_idx += 1
-                    return self.next(last_score, score_type=score_type, recurs=True)
-
-        else:
+                self.combo_1_current_idx += 1
 
-            if self.combo_1_status:
+                if applies:
+                    combo = (combo | self.forcings)
+                    if combo not in self.completed:
+                        self.completed.add(combo)
+                        return combo
 
-                if self.combo_1_best_idx:
+            elif self.combo_1_best_idx:
+                if self.combo_1_status:
                     self.current_combo_1 = (
-                                self.current_combo_1 | 2 ** self.combo_1_best_idx)
+                        self.current_combo_1 | 2 ** self.combo_1_best_idx)
                     self.current_combo_1 = (self.current_combo_1 | self.forcings)
-                    self.combo_1_current_idx = 0
-                    self.combo_1_best_idx = None
-                    return self.next(last_score, score_type=score_type, recurs=True)
                 else:
-                    self.combo_1_status = 0
-                    self.combo_1_current_idx = 0
-                    self.combo_1_best_idx = None
-                    return self.next(last_score, score_type=score_type, recurs=True)
+                    self.current_combo_1 = self.toggle_bit(self.current_combo_1,
+                                                           self.combo_1_best_idx)
+                self.combo_1_current_idx = 0
+                self.combo_1_best_idx = None
+
+            elif self.combo_1_status:
+                self.combo_1_status = 0
+                self.combo_1_current_idx = 0
+                self.combo_1_best_idx = None
 
             else:
+                self.combo_1_current_idx = 0
+                self.combo_1_best_idx = None
+                if not self.first_randomizer:
+                    self.combo_1_status = 1
+                self.randomize()
+                last_score = None
+
+    def next_batch(self, last_scores=None, score_type=0, size=None):
+        """Returns every model of the next adding or removing phase at once, so
+        that they can be evaluated together.
+
+        'last_scores' are the scores of the models returned by the previous
+        call, in the same order (None for models that could not be scored).
+        The phase's best model becomes the new current combination if it
+        beats the best score so far. Otherwise the selector moves from adding
+        to removing, or from removing to a random restart. 'size' is not used,
+        since a phase is always returned whole. Returns an empty list once the
+        search is finished.
+        """
 
-                if self.combo_1_best_idx:
-                    self.current_combo_1 = self.toggle_bit(self.current_combo_1,
-                                                           self.combo_1_best_idx)
-                    self.combo_1_current_idx = 0
-                    self.combo_1_best_idx = None
-                    return self.next(last_score, score_type=score_type, recurs=True)
+        if not self.running:
+            self.start(score_type)
+
+        # Pick the best model of the last phase
+        best_idx = None
+        for idx, score in zip(self.batch_idx, last_scores or []):
+            if score is None or score != score:
+                continue
+            if (score_type == 0 and score < self.current_score_1) or (
+                    score_type == 1 and score > self.current_score_1):
+                self.current_score_1 = score
+                best_idx = idx
+        self.batch_idx = []
+
+        # Move on to the next phase that has any models left to evaluate
+        empty_phases = 0
+        while True:
+
+            if self.out_of_time():
+                return []
+
+            if self.phase_started:
+                if best_idx is not None:
+                    if self.combo_1_status:
+                        self.current_combo_1 = (
+                            self.current_combo_1 | 2 ** best_idx | self.forcings)
+                    else:
+                        self.current_combo_1 = self.toggle_bit(
+                            self.current_combo_1, best_idx)
+                elif self.combo_1_status:
+                    self.combo_1_status = 0
                 else:
-                    self.combo_1_current_idx = 0
-                    self.combo_1_best_idx = None
                     if not self.first_randomizer:
                         self.combo_1_status = 1
                     self.randomize()
-
-                    return self.next(score_type=score_type, recurs=True)
+            best_idx = None
+            self.phase_started = True
+
+            batch = []
+            for idx in range(self.num_predictors):
+                bit = 2 ** idx
+                if self.combo_1_status == bool(self.current_combo_1 & bit):
+                    continue
+                combo = (self.current_combo_1 ^ bit) | self.forcings
+                if combo in self.completed:
+                    continue
+                self.completed.add(combo)
+                self.batch_idx.append(idx)
+                batch.append(combo)
+
+            if batch:
+                return batch
+
+            # Jump somewhere else if the search keeps running into phases
+            # that have already been evaluated
+            empty_phases += 1
+            if empty_phases > self.num_predictors:
+                self.randomize()
+                empty_phases = 0
@@ -1,8 +1,9 @@
 from collections import OrderedDict
 
-from . import SMFS, BruteForce
+from . import SMFS, BruteForce, LeapsBounds
 
 FEATURE_SEL = OrderedDict([
     ('SMFS', SMFS.SMFS),
-    ('Brute Force', BruteForce.BruteForce)
+    ('Brute Force', BruteForce.BruteForce),
+    ('Leaps and Bounds', LeapsBounds.LeapsBounds)
 ])
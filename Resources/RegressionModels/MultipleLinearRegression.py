@@ -5,8 +5,285 @@ import numpy as np
 from PySide6.QtWidgets import QApplication
 from numba import jit
 
+from Resources.CrossValidation import CROSS_VALIDATION, get_fold_plan
+from Resources.CrossValidation.LOO import MAX_LEVERAGE, press_predict
+
 finfo = float_info.epsilon
 
+# Largest condition number of the (column-equilibrated) X'X that the batched
+# solver will handle directly. Anything beyond this is handed back to
+# `train_model` so that nearly singular designs are treated exactly as they
+# are for a single model.
+BATCH_COND_LIMIT = 1 / np.sqrt(finfo)
+
+# Number of fold Gram matrices kept by each regressor
+GRAM_CACHE_SIZE = 8
+
+
+@jit(nopython=True, cache=True)
+def cholesky_factor(gram, cols, k, l):
+    """Factors X'X of the columns 'cols[:k]' of every fold's Gram matrix
+    from scratch into 'l' (folds x cols x cols)."""
+
+    l[:] = 0
+    for f in range(gram.shape[0]):
+        for i in range(k):
+            for jj in range(i + 1):
+                s = gram[f, cols[i], cols[jj]]
+                for q in range(jj):
+                    s -= l[f, i, q] * l[f, jj, q]
+                if i == jj:
+                    l[f, i, i] = np.sqrt(s) if s > 0 else np.nan
+                else:
+                    l[f, i, jj] = s / l[f, jj, jj]
+
+
+@jit(nopython=True, cache=True)
+def cholesky_border(gram, cols, k, c, l):
+    """Borders the factors 'l' of the columns 'cols[:k]' with column 'c'
+    (the caller appends 'c' to 'cols')."""
+
+    for f in range(gram.shape[0]):
+        pivot = gram[f, c, c]
+        for i in range(k):
+            s = gram[f, cols[i], c]
+            for q in range(i):
+                s -= l[f, i, q] * l[f, k, q]
+            l[f, k, i] = s / l[f, i, i]
+            l[f, i, k] = 0
+            pivot -= l[f, k, i] * l[f, k, i]
+        l[f, k, k] = np.sqrt(pivot) if pivot > 0 else np.nan
+
+
+@jit(nopython=True, cache=True)
+def cholesky_downdate(k, pos, l):
+    """Drops the column at position 'pos' from the factors 'l' of 'k'
+    columns, restoring the triangle with Givens rotations (the caller
+    removes it from 'cols')."""
+
+    for f in range(l.shape[0]):
+        for r in range(pos, k - 1):
+            for q in range(k):
+                l[f, r, q] = l[f, r + 1, q]
+        for i in range(pos, k - 1):
+            a = l[f, i, i]
+            b = l[f, i, i + 1]
+            h = np.hypot(a, b)
+            cs = a / h
+            sn = b / h
+            for r in range(i, k - 1):
+                li = l[f, r, i]
+                lj = l[f, r, i + 1]
+                l[f, r, i] = cs * li + sn * lj
+                l[f, r, i + 1] = cs * lj - sn * li
+        for q in range(k):
+            l[f, k - 1, q] = 0
+            l[f, q, k - 1] = 0
+
+
+@jit(nopython=True, cache=True)
+def cholesky_predict(gram, z_test, fold_of_row, cols, k, l, limit, y_p, coefs,
+                     w, beta):
+    """Solves every fold's fit from its factors 'l' of the columns
+    'cols[:k]', writing the cross-validated predictions into 'y_p' and the
+    full-period coefficients into 'coefs' (by column).
+
+    Returns False, without solving, if a column's squared pivot is more
+    than 'limit' times smaller than its sum of squares in any fold.
+    """
+
+    folds = gram.shape[0]
+    y_col = gram.shape[1] - 1
+
+    for f in range(folds):
+        for i in range(k):
+            if not l[f, i, i] * l[f, i, i] * limit > gram[f, cols[i], cols[i]]:
+                return False
+
+    for f in range(folds):
+        for i in range(k):
+            s = gram[f, cols[i], y_col]
+            for q in range(i):
+                s -= l[f, i, q] * w[q]
+            w[i] = s / l[f, i, i]
+        for i in range(k - 1, -1, -1):
+            s = w[i]
+            for q in range(i + 1, k):
+                s -= l[f, q, i] * beta[f, q]
+            beta[f, i] = s / l[f, i, i]
+
+    for t in range(z_test.shape[0]):
+        f = fold_of_row[t]
+        s = 0.0
+        for i in range(k):
+            s += z_test[t, cols[i]] * beta[f, i]
+        y_p[t] = s
+
+    for i in range(k):
+        coefs[cols[i]] = beta[folds - 1, i]
+
+    return True
+
+
+@jit(nopython=True, cache=True)
+def gray_chain_predict(gram, z_test, fold_of_row, genomes, limit):
+    """Cross-validates a chain of predictor subsets in which every subset
+    differs from the one before it by a single predictor (a Gray code).
+
+    The Cholesky factors of every fold are bordered or downdated (with
+    Givens rotations) as the chain adds or drops a predictor, rather than
+    being solved from scratch for every subset.
+
+    args:
+      gram (`np.ndarray`) - folds x cols x cols Gram matrices of [1, x, y]
+                            (the full fit last, see `fold_grams`)
+      z_test (`np.ndarray`) - [1, x, y] in prediction order
+      fold_of_row (`np.ndarray`) - the fold predicting each row of z_test
+      genomes (`np.ndarray`) - subsets x predictors boolean array
+      limit (`float`) - largest allowed ratio between a column's sum of
+                        squares and its squared pivot
+
+    returns the (subsets x rows) predictions, the (subsets x cols-1)
+    full-period coefficients by column (NaN for unused columns) and a mask
+    of the subsets whose factors were too badly conditioned to be used.
+    """
+
+    folds = gram.shape[0]
+    m, p = genomes.shape
+    n = z_test.shape[0]
+
+    y_p = np.full((m, n), np.nan)
+    coefs = np.full((m, p + 1), np.nan)
+    redo = np.zeros(m, dtype=np.bool_)
+
+    l = np.zeros((folds, p + 1, p + 1))
+    beta = np.zeros((folds, p + 1))
+    w = np.zeros(p + 1)
+    cols = np.zeros(p + 1, dtype=np.int64)
+    k = 0
+    refactor = True
+
+    for g in range(m):
+
+        if refactor:
+            # Factor this subset from scratch
+            k = 1
+            cols[0] = 0
+            for j in range(p):
+                if genomes[g, j]:
+                    cols[k] = j + 1
+                    k += 1
+            cholesky_factor(gram, cols, k, l)
+            refactor = False
+
+        else:
+            j = 0
+            while genomes[g, j] == genomes[g - 1, j]:
+                j += 1
+            c = j + 1
+
+            if genomes[g, j]:
+                # Border the factors with the new column
+                cholesky_border(gram, cols, k, c, l)
+                cols[k] = c
+                k += 1
+
+            else:
+                # Drop the column's row and restore the triangle
+                pos = 0
+                while cols[pos] != c:
+                    pos += 1
+                cholesky_downdate(k, pos, l)
+                for i in range(pos, k - 1):
+                    cols[i] = cols[i + 1]
+                k -= 1
+
+        # Hand badly conditioned subsets back, and start the next one afresh
+        if not cholesky_predict(gram, z_test, fold_of_row, cols, k, l, limit,
+                                y_p[g], coefs[g], w, beta):
+            redo[g] = True
+            refactor = True
+
+    return y_p, coefs, redo
+
+
+@jit(nopython=True, cache=True)
+def toggle_predict(gram, z_test, fold_of_row, base, genomes, limit):
+    """Cross-validates predictor subsets that each add or drop one predictor
+    from the subset 'base' (a phase of SMFS).
+
+    The fold Cholesky factors of 'base' are computed once, and each subset's
+    factors are that factor bordered with its new column (rank-one update)
+    or with its dropped column removed (rank-one downdate).
+
+    Takes and returns the same as `gray_chain_predict`, with 'base' a
+    boolean array over the predictors.
+    """
+
+    folds = gram.shape[0]
+    m, p = genomes.shape
+    n = z_test.shape[0]
+
+    y_p = np.full((m, n), np.nan)
+    coefs = np.full((m, p + 1), np.nan)
+    redo = np.zeros(m, dtype=np.bool_)
+
+    base_l = np.zeros((folds, p + 1, p + 1))
+    base_cols = np.zeros(p + 1, dtype=np.int64)
+    base_k = 1
+    for j in range(p):
+        if base[j]:
+            base_cols[base_k] = j + 1
+            base_k += 1
+    cholesky_factor(gram, base_cols, base_k, base_l)
+
+    l = np.zeros((folds, p + 1, p + 1))
+    beta = np.zeros((folds, p + 1))
+    w = np.zeros(p + 1)
+    cols = np.zeros(p + 1, dtype=np.int64)
+
+    for g in range(m):
+
+        l[:] = base_l
+        cols[:] = base_cols
+        k = base_k
+
+        j = 0
+        while genomes[g, j] == base[j]:
+            j += 1
+        c = j + 1
+
+        if genomes[g, j]:
+            cholesky_border(gram, cols, k, c, l)
+            cols[k] = c
+            k += 1
+        else:
+            pos = 0
+            while cols[pos] != c:
+                pos += 1
+            cholesky_downdate(k, pos, l)
+            for i in range(pos, k - 1):
+                cols[i] = cols[i + 1]
+            k -= 1
+
+        if not cholesky_predict(gram, z_test, fold_of_row, cols, k, l, limit,
+                                y_p[g], coefs[g], w, beta):
+            redo[g] = True
+
+    return y_p, coefs, redo
+
+
+def toggled_base(genomes):
+    """Returns the subset that every one of 'genomes' adds one predictor to,
+    or drops one predictor from, or None if there isn't one."""
+
+    for base in (genomes.all(axis=0), genomes.any(axis=0)):
+        if (np.count_nonzero(genomes != base, axis=1) == 1).all():
+            return base
+
+    return None
+
+
 app = QApplication.instance()
 
 
@@ -21,9 +298,17 @@ class Regressor:
             ]
         )
 
-        self.cross_validation = app.cross_validation[cross_validation]
+        self.cross_validation = CROSS_VALIDATION[cross_validation]
+        self.cv_scheme = cross_validation
         self.coef_ = np.full((500,), np.nan, dtype=np.float64)
 
+        # Leave-one-out predictions come from a single fit (PRESS residuals)
+        self.press = cross_validation == 'LEAVE ONE OUT'
+
+        # Fold Gram matrices for recently evaluated rows (see
+        # `batch_cross_val_predict`)
+        self.gram_cache = OrderedDict()
+
     def is_positive_corr(self):
 
         return np.array([True if c >= 0 else False for c in self.coef_[1:]])
@@ -41,35 +326,251 @@ class Regressor:
                 self.exposed_params[param_key] = coef[1:]
                 continue
 
-    def cross_val_predict(self, x, y):
+    def cross_val_predict(self, x, y, out=None):
+        """Cross-validates the model, returning the predictions and the actual
+        values in fold order.
 
-        y_p = np.array([])
-        y_a = np.array([])
+        If 'out' is given (an array at least as long as y), the predictions
+        are written into it and the returned y_p is a view of it, so it is
+        only valid until 'out' is used again.
+        """
 
         if len(y) < 2:
             return np.full(y.shape, np.nan), y
 
-        for indices in self.cross_validation.yield_samples(len(y)):
-            x_train = x[indices]
-            y_train = y[indices]
-
-            self.coef_ = self.train_model(x_train, y_train)
+        plan = get_fold_plan(self.cv_scheme, len(y))
+        y_p = plan.prediction_buffer(out)
 
-            idx = [not elem for elem in indices]
-            x_test = x[idx]
-            y_test = y[idx]
-            y_p_cv = self.predict(x_test)
+        if self.press and len(y) > 2:
+            coef = self.train_model(x, y)
+            mX = np.column_stack((np.ones(len(y)), x))
+            a = mX.T.dot(mX)
+            if not np.isnan(coef).any() and self.well_conditioned(a):
+                y_p_loo, leverage = press_predict(
+                    mX, y, np.linalg.pinv(a), coef)
+                if leverage.max() < MAX_LEVERAGE:
+                    self.coef_ = coef
+                    y_p[:] = y_p_loo
+                    return y_p, y.astype(np.float64)
 
-            y_p = np.append(y_p, y_p_cv)
-            y_a = np.append(y_a, y_test)
+        for start, (train, test) in zip(plan.starts, plan):
+            self.coef_ = self.train_model(x[train], y[train])
+            y_p[start:start + len(test)] = self.predict(x[test])
 
         # Fit the model as normal
         self.coef_ = self.train_model(x, y)
 
-        return y_p, y_a
+        return y_p, y[plan.order]
+
+    def fit(self, x, y):
+        """Fits the model to x and y, without cross-validating."""
+        self.coef_ = self.train_model(x, y)
+
+    def batch_fit(self, x, y, weights):
+        """Fits the model once for each row of 'weights', the number of times
+        each sample is used (e.g. bootstrap resample counts), as one stacked
+        weighted least squares problem.
+
+        Returns a fits x (1 + predictors) array of coefficients. A fit whose
+        resampled design is too ill-conditioned is NaN, as in `train_model`.
+        """
+
+        mX = np.column_stack((np.ones(len(y)), x))
+        weights = np.asarray(weights, dtype=np.float64)
+
+        # Repeating a sample w times adds w times its outer product
+        gram = np.einsum('bn,ni,nj->bij', weights, mX, mX)
+        xty = np.einsum('bn,ni,n->bi', weights, mX, y)
+        beta = np.einsum('bij,bj->bi', np.linalg.pinv(gram), xty)
+
+        # sqrt(w) * mX has the singular values of the resampled design
+        cond = np.linalg.cond(np.sqrt(weights)[:, :, None] * mX)
+        beta[~(cond < 1 / finfo)] = np.nan
+
+        return beta
+
+    def fold_grams(self, x, y, rows_key=None):
+        """Builds the Gram matrix of [1, x, y] for every training fold, plus one
+        for the full fit (the last entry).
+
+        If 'rows_key' is given, the result is cached under that key so that
+        subsets evaluated on the same rows share the work.
+        """
+
+        if rows_key is not None and rows_key in self.gram_cache:
+            self.gram_cache.move_to_end(rows_key)
+            return self.gram_cache[rows_key]
+
+        n = len(y)
+        plan = get_fold_plan(self.cv_scheme, n)
+        z = np.column_stack((np.ones(n), np.nan_to_num(x), y))
+        weights = np.vstack(
+            (plan.train_mask, np.ones(n, dtype=bool))).astype(np.float64)
+        gram = np.einsum('fn,ni,nj->fij', weights, z, z)
+
+        grams = (z, weights, gram, plan.order, plan.fold_of_row)
+        if rows_key is not None:
+            self.gram_cache[rows_key] = grams
+            if len(self.gram_cache) > GRAM_CACHE_SIZE:
+                self.gram_cache.popitem(last=False)
+
+        return grams
+
+    def fallback_fit(self, z, weights, y, folds, cols, beta):
+        """Fits the folds in 'folds' with `train_model`, writing the
+        coefficients (in the column order 'cols') into 'beta'."""
+
+        pos = np.argsort(cols)
+        for f in folds:
+            rows = weights[f] > 0
+            beta[f, pos] = self.train_model(
+                z[rows][:, np.sort(cols)[1:]], y[rows])
+
+    def batch_cross_val_predict(self, x, y, genomes, rows_key=None):
+        """Cross-validates many predictor subsets at once.
+
+        The Gram matrices X'X and X'y of every predictor (plus the intercept)
+        are built once per training fold, and each subset's coefficients are
+        solved from slices of those matrices, all subsets of a given size in
+        one call.
+
+        args:
+          x (`np.ndarray`) - rows x predictors matrix holding every predictor in
+                             the pool (columns not used by a subset may be NaN)
+          y (`np.ndarray`) - predictand
+          genomes (`np.ndarray`) - subsets x predictors boolean array
+          rows_key (`bytes`) - optional key identifying the rows of x and y,
+                               used to cache the fold Gram matrices
+
+        returns:
+          y_p (`np.ndarray`) - subsets x predictions array of cross-validated
+                               predictions
+          y_a (`np.ndarray`) - the actual values matching the columns of y_p
+          coefs (`list`) - the full-period coefficients for every subset
+        """
+
+        genomes = np.asarray(genomes, dtype=bool)
+        num_genomes = len(genomes)
+
+        if len(y) < 2:
+            return np.full((num_genomes, len(y)), np.nan), y, [
+                np.full(g.sum() + 1, np.nan) for g in genomes]
+
+        z, weights, gram, order, fold_of_row = self.fold_grams(x, y, rows_key)
+        y_col = z.shape[1] - 1
+        z_test = z[order]
+
+        y_p = np.full((num_genomes, len(order)), np.nan)
+        coefs = [None] * num_genomes
+        todo = np.arange(num_genomes)
+
+        # Subsets that each differ from the last by one predictor (as brute
+        # force hands them out) are walked with updates of the fold factors,
+        # and subsets that each toggle one predictor of a common subset (an
+        # SMFS phase) are updated from its factors. Any that are badly
+        # conditioned are solved with the rest below.
+        update = None
+        if not self.press and num_genomes > 1:
+            base = toggled_base(genomes)
+            if base is not None:
+                update = toggle_predict(
+                    gram, z_test, fold_of_row, base, genomes, BATCH_COND_LIMIT)
+            elif (np.count_nonzero(
+                    genomes[1:] != genomes[:-1], axis=1) == 1).all():
+                update = gray_chain_predict(
+                    gram, z_test, fold_of_row, genomes, BATCH_COND_LIMIT)
+        if update is not None:
+            update_p, update_coefs, redo = update
+            y_p[~redo] = update_p[~redo]
+            used = np.column_stack((np.ones(num_genomes, dtype=bool), genomes))
+            for m in np.flatnonzero(~redo):
+                coefs[m] = update_coefs[m][used[m]]
+            todo = np.flatnonzero(redo)
+
+        sizes = genomes.sum(axis=1)
+        for size in np.unique(sizes[todo]):
+            members = todo[sizes[todo] == size]
+            cols = np.zeros((len(members), size + 1), dtype=np.int64)
+            cols[:, 1:] = np.nonzero(genomes[members])[1].reshape(-1, size) + 1
+
+            a = gram[:, cols[:, :, None], cols[:, None, :]]
+            b = gram[:, cols, y_col]
+
+            # Leave-one-out subsets that pass the PRESS checks are done with
+            # the full fit. The rest go through every fold below.
+            if self.press and len(y) > 2:
+                press_p, press_coefs, done = self.batch_press(
+                    a[-1], b[-1], z[:, cols], y)
+                y_p[members[done]] = press_p[done]
+                for i in np.flatnonzero(done):
+                    coefs[members[i]] = press_coefs[i]
+                members, cols = members[~done], cols[~done]
+                a, b = a[:, ~done], b[:, ~done]
+                if not len(members):
+                    continue
+
+            # Judge the conditioning on the equilibrated matrix, so that the
+            # units of the predictors don't matter
+            scale = 1 / np.sqrt(np.diagonal(a, axis1=-2, axis2=-1))
+            eig = np.linalg.eigvalsh(a * scale[..., :, None] * scale[..., None, :])
+            solvable = (eig[..., 0] > 0) & (
+                eig[..., -1] < BATCH_COND_LIMIT * eig[..., 0])
+            beta = np.full(b.shape, np.nan)
+            if solvable.any():
+                beta[solvable] = np.linalg.solve(
+                    a[solvable], b[solvable][..., None])[..., 0]
+
+            # Fall back to the single-model fit for badly conditioned folds
+            for i in np.unique(np.nonzero(~solvable)[1]):
+                self.fallback_fit(z, weights, y, np.flatnonzero(~solvable[:, i]),
+                                  cols[i], beta[:, i])
+
+            y_p[members] = np.einsum(
+                'tmk,tmk->mt', z_test[:, cols], beta[fold_of_row])
+
+            for i, m in enumerate(members):
+                coefs[m] = beta[-1, i]
+
+        return y_p, y[order], coefs
+
+    @staticmethod
+    def well_conditioned(a):
+        """Whether the (stack of) X'X 'a' is well enough conditioned, once its
+        columns are equilibrated, for the leave-one-out shortcut (see
+        BATCH_COND_LIMIT)."""
+
+        scale = 1 / np.sqrt(np.diagonal(a, axis1=-2, axis2=-1))
+        eig = np.linalg.eigvalsh(a * scale[..., :, None] * scale[..., None, :])
+
+        return (eig[..., 0] > 0) & (eig[..., -1] < BATCH_COND_LIMIT * eig[..., 0])
+
+    def batch_press(self, a, b, z_cols, y):
+        """Leave-one-out predictions for a stack of full-period fits.
+
+        args:
+          a (`np.ndarray`) - subsets x k x k stack of X'X
+          b (`np.ndarray`) - subsets x k stack of X'y
+          z_cols (`np.ndarray`) - rows x subsets x k design matrices
+
+        returns the (subsets x rows) predictions, the (subsets x k)
+        coefficients and a mask of the subsets the shortcut could be used for.
+        """
+
+        done = self.well_conditioned(a)
+
+        y_p = np.full((len(a), len(y)), np.nan)
+        beta = np.full(b.shape, np.nan)
+        if done.any():
+            a_inv = np.linalg.inv(a[done])
+            beta[done] = np.einsum('mkj,mj->mk', a_inv, b[done])
+            y_p[done], leverage = press_predict(
+                z_cols[:, done].transpose(1, 0, 2), y, a_inv, beta[done])
+            done[done] = leverage.max(axis=1) < MAX_LEVERAGE
+
+        return y_p, beta, done
 
     @staticmethod
-    @jit(nopython=True)
+    @jit(nopython=True, cache=True)
     def train_model(x, y):
 
         n_row = len(y)
@@ -5,13 +5,16 @@ import numpy as np
 from PySide6.QtWidgets import QApplication
 from numba import jit
 
+from Resources.CrossValidation import CROSS_VALIDATION, get_fold_plan
+from Resources.CrossValidation.LOO import MAX_LEVERAGE, press_predict
+
 app = QApplication.instance()
 finfo = float_info.epsilon
 
 
 class Regressor:
 
-    def __init__(self, cross_validation=None):
+    def __init__(self, cross_validation=None, pc_retain=None):
 
         self.exposed_params = OrderedDict(
             [
@@ -21,11 +24,17 @@ class Regressor:
             ]
         )
 
-        self.pc_retain = app.settings['max_pc_mode_variance']
+        if pc_retain is None:
+            pc_retain = app.settings['max_pc_mode_variance']
+        self.pc_retain = pc_retain
 
-        self.cross_validation = app.cross_validation[cross_validation]
+        self.cross_validation = CROSS_VALIDATION[cross_validation]
+        self.cv_scheme = cross_validation
         self.coef_ = np.full((500,), np.nan)
 
+        # Leave-one-out predictions come from a single fit (PRESS residuals)
+        self.press = cross_validation == 'LEAVE ONE OUT'
+
     def is_positive_corr(self):
 
         return np.array([True if c >= 0 else False for c in self.coef_[1:]])
@@ -65,50 +74,78 @@ class Regressor:
         # Transform and return the parameters
         return np.dot(data, eigenvectors), eigenvalues, eigenvectors
 
-    def cross_val_predict(self, x, y):
+    def cross_val_predict(self, x, y, out=None):
+        """Cross-validates the model, returning the predictions and the actual
+        values in fold order.
+
+        If 'out' is given (an array at least as long as y), the predictions
+        are written into it and the returned y_p is a view of it.
+        """
+
+        PC = self.principal_components(x)
+        if PC is None:
+            return np.full(y.shape, np.nan), y
+
+        plan = get_fold_plan(self.cv_scheme, len(y))
+        y_p = plan.prediction_buffer(out)
+
+        # The principal components are fixed across the folds, so each fold is
+        # a least squares fit on [1, PC] and the leave-one-out predictions
+        # can be taken from the full fit.
+        if self.press and len(y) > 2:
+            coef = self.train_model(PC, y, self.evecs, self.n_pcs, self.std,
+                                    self.mean)
+            if not np.isnan(coef).any():
+                mX = np.column_stack((np.ones(len(y)), PC))
+                a_inv = np.linalg.pinv(mX.T.dot(mX))
+                y_p_loo, leverage = press_predict(
+                    mX, y, a_inv, a_inv.dot(mX.T).dot(y))
+                if leverage.max() < MAX_LEVERAGE:
+                    self.coef_ = coef
+                    y_p[:] = y_p_loo
+                    return y_p, y.astype(np.float64)
+
+        # Find the best
+
+        for start, (train, test) in zip(plan.starts, plan):
+            self.coef_ = self.train_model(PC[train], y[train], self.evecs,
+                                          self.n_pcs, self.std, self.mean)
+            y_p[start:start + len(test)] = self.predict(x[test])
+
+        # Fit the model as normal
+        self.coef_ = self.train_model(PC, y, self.evecs, self.n_pcs, self.std, self.mean)
 
-        y_p = np.array([])
-        y_a = np.array([])
+        return y_p, y[plan.order]
+
+    def principal_components(self, x):
+        """Standardizes x and returns its retained principal components, or
+        None if x can't be standardized (or has fewer than 2 predictors)."""
 
         if x.shape[1] < 2:
-            y_p = np.full(y.shape, np.nan)
-            y_a = y
-            return y_p, y_a
+            return None
 
         self.mean = np.nanmean(x, axis=0, dtype=np.float64)
         self.std = np.nanstd(x, axis=0, ddof=1)
         if any(np.isnan(self.std)):
-            return np.full(y.shape, np.nan), y
+            return None
         if not all(self.std):
-            return np.full(y.shape, np.nan), y
+            return None
         x_std = (x - self.mean) / self.std
 
         PC, self.evals, self.evecs = self.to_princ_comps(x_std)
         cum_var = np.cumsum(self.evals) / PC.shape[1]
         self.n_pcs = np.where(cum_var >= self.pc_retain)[0][0] + 1
-        PC = PC[:, :self.n_pcs]
-
-        # Find the best
-
-        for indices in self.cross_validation.yield_samples(len(y)):
-            x_train = PC[indices]
-            y_train = y[indices]
+        return PC[:, :self.n_pcs]
 
-            self.coef_ = self.train_model(x_train, y_train, self.evecs, self.n_pcs,
-                                          self.std, self.mean)
-
-            idx = [not elem for elem in indices]
-            x_test = x[idx]
-            y_test = y[idx]
-            y_p_cv = self.predict(x_test)
-
-            y_p = np.append(y_p, y_p_cv)
-            y_a = np.append(y_a, y_test)
-
-        # Fit the model as normal
-        self.coef_ = self.train_model(PC, y, self.evecs, self.n_pcs, self.std, self.mean)
+    def fit(self, x, y):
+        """Fits the model to x and y, without cross-validating."""
 
-        return y_p, y_a
+        PC = self.principal_components(x)
+        if PC is None:
+            self.coef_ = np.full(x.shape[1] + 1, np.nan)
+            return
+        self.coef_ = self.train_model(PC, y, self.evecs, self.n_pcs, self.std,
+                                      self.mean)
 
     @staticmethod
     @jit(nopython=True, cache=True)
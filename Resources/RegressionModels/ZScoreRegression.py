@@ -4,6 +4,8 @@ from sys import float_info
 import numpy as np
 from PySide6.QtWidgets import QApplication
 
+from Resources.CrossValidation import CROSS_VALIDATION, get_fold_plan
+
 app = QApplication.instance()
 
 
@@ -18,7 +20,8 @@ class Regressor:
             ]
         )
 
-        self.cross_validation = app.cross_validation[cross_validation]
+        self.cross_validation = CROSS_VALIDATION[cross_validation]
+        self.cv_scheme = cross_validation
         self.coef_ = np.full((500,), np.nan)
 
     def is_positive_corr(self):
@@ -38,29 +41,29 @@ class Regressor:
                 self.exposed_params[param_key] = coef
                 continue
 
-    def cross_val_predict(self, x, y):
-
-        y_p = np.array([])
-        y_a = np.array([])
-
-        for indices in self.cross_validation.yield_samples(len(y)):
-            x_train = x[indices]
-            y_train = y[indices]
+    def cross_val_predict(self, x, y, out=None):
+        """Cross-validates the model, returning the predictions and the actual
+        values in fold order.
 
-            self.train_model(x_train, y_train)
+        If 'out' is given (an array at least as long as y), the predictions
+        are written into it and the returned y_p is a view of it.
+        """
 
-            idx = [not elem for elem in indices]
-            x_test = x[idx]
-            y_test = y[idx]
-            y_p_cv = self.predict(x_test)
+        plan = get_fold_plan(self.cv_scheme, len(y))
+        y_p = plan.prediction_buffer(out)
 
-            y_p = np.append(y_p, y_p_cv)
-            y_a = np.append(y_a, y_test)
+        for start, (train, test) in zip(plan.starts, plan):
+            self.train_model(x[train], y[train])
+            y_p[start:start + len(test)] = self.predict(x[test])
 
         # Fit the model as normal
         self.train_model(x, y)
 
-        return y_p, y_a
+        return y_p, y[plan.order]
+
+    def fit(self, x, y):
+        """Fits the model to x and y, without cross-validating."""
+        self.train_model(x, y)
 
     def train_model(self, x, y):
 
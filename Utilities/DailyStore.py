@@ -0,0 +1,141 @@
+"""
+DailyStore.py
+
+A compact storage engine for daily dataset data.
+
+A "DailyStore" keeps a daily series as the date of its first value and a
+contiguous array of values (one per day, NaN on days the series doesn't
+have), instead of a pandas Series with its own DatetimeIndex. Every store
+shares one daily calendar, so the pandas Series is only built when it's
+asked for, and finding the values in a range of dates is a slice.
+"""
+
+import numpy as np
+import pandas as pd
+
+# The shared calendar: every day from CALENDAR_START to CALENDAR_END
+CALENDAR_START = np.datetime64('1800-01-01', 'D')
+CALENDAR_END = np.datetime64('2200-12-31', 'D')
+_calendar = None
+
+# Series that would need more than this many days per value (e.g. monthly
+# data) aren't worth storing on a daily calendar
+MAX_DAYS_PER_VALUE = 2
+
+
+def calendar():
+    """Returns the shared daily calendar (`pd.DatetimeIndex`)."""
+
+    global _calendar
+    if _calendar is None:
+        _calendar = pd.date_range(str(CALENDAR_START), str(CALENDAR_END), freq='D')
+
+    return _calendar
+
+
+class DailyStore:
+    """Daily values stored as a start date and an array on the shared calendar.
+
+    Class Variables:
+    "start" : day (`np.datetime64[D]`) of the first value
+    "values" : one value for every day from "start" on
+    "present" : which days the series has a value for, or None if it has one
+                for every day (missing values that were in the series are
+                kept as NaN, and are present)
+    "name" : name of the series
+    """
+
+    def __init__(self, start, values, present=None, name=None):
+
+        self.start = start
+        self.values = values
+        self.present = present
+        self.name = name
+
+    @classmethod
+    def from_series(cls, series, dtype='float64'):
+        """Returns a DailyStore holding 'series', or None if 'series' can't be
+        stored compactly (it isn't a float series of distinct, sorted,
+        midnight dates within the calendar, or is too sparse)."""
+
+        if (not isinstance(series, pd.Series) or series.empty
+                or series.dtype.kind != 'f'
+                or not isinstance(series.index, pd.DatetimeIndex)
+                or series.index.tz is not None):
+            return None
+
+        times = series.index.values
+        days = times.astype('datetime64[D]')
+        if (days != times).any() or (np.diff(days).astype(np.int64) <= 0).any():
+            return None
+        if days[0] < CALENDAR_START or days[-1] > CALENDAR_END:
+            return None
+
+        offsets = (days - days[0]).astype(np.int64)
+        n = int(offsets[-1]) + 1
+        if n > MAX_DAYS_PER_VALUE * len(series):
+            return None
+
+        if n == len(series):
+            values = series.values.astype(dtype)
+            present = None
+        else:
+            values = np.full(n, np.nan, dtype=dtype)
+            values[offsets] = series.values
+            present = np.zeros(n, dtype=bool)
+            present[offsets] = True
+
+        return cls(days[0], values, present, series.name)
+
+    @property
+    def offset(self):
+        """Position of the first value on the shared calendar."""
+        return int((self.start - CALENDAR_START).astype(np.int64))
+
+    @property
+    def first_date(self):
+        return pd.Timestamp(self.start)
+
+    @property
+    def last_date(self):
+        return pd.Timestamp(self.start + np.timedelta64(len(self.values) - 1, 'D'))
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (0 if self.present is None else self.present.nbytes)
+
+    def copy(self):
+        """Returns a DailyStore with the data read into memory."""
+        return DailyStore(self.start, np.array(self.values),
+                          None if self.present is None else np.array(self.present),
+                          self.name)
+
+    def padded_values(self):
+        """Returns the float64 values for every day from "start" on, with NaN on
+        days that the series doesn't have."""
+        return self.values.astype(np.float64, copy=False)
+
+    def locate(self, lefts, rights):
+        """Returns the (starts, ends) positions in "values" of the days from
+        each of 'lefts' to each of 'rights' (both inclusive)."""
+
+        n = len(self.values)
+        lefts = np.asarray(lefts, dtype='datetime64[D]')
+        rights = np.asarray(rights, dtype='datetime64[D]')
+        starts = np.clip((lefts - self.start).astype(np.int64), 0, n)
+        ends = np.clip((rights - self.start).astype(np.int64) + 1, 0, n)
+
+        return starts, np.maximum(starts, ends)
+
+    def series(self):
+        """Builds the pandas Series for the stored values. The Series is read
+        only, since it may share memory with the store."""
+
+        index = calendar()[self.offset:self.offset + len(self.values)]
+        values = self.padded_values().view()
+        if self.present is not None:
+            index = index[self.present]
+            values = values[self.present]
+        values.flags.writeable = False
+
+        return pd.Series(values, index=index, name=self.name, copy=False)
@@ -168,7 +168,7 @@ class Exporter:
 
                 skipcount = 0
                 for i, model in enumerate(app.saved_models.saved_models):
-                    if year in model.forecasts.forecasts.index.get_level_values(0):
+                    if year in model.forecasts:
 
                         app.gui.status_bar.showMessage(
                             f'Exporting to Excel (Saved Models):'
@@ -209,7 +209,7 @@ class Exporter:
                                 )
                             elif col.endswith('%'):
                                 ex = int(col.strip('%')) / 100
-                                val = model.forecasts.forecasts.loc[(year, ex), 'Value']
+                                val = model.forecasts.get(year).loc[ex]
                                 saved_models_sheet.write(
                                     i + 1 - skipcount, j, f'{val:0.5g}'
                                 )
@@ -1,18 +1,79 @@
+import gc
+import hashlib
+import io
+import os
 import pickle
 import sqlite3
 import uuid
+import zipfile
+import zlib
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from PySide6.QtWidgets import QApplication
 
 from Models.ModelConfigurations import (PredictorPool, Regressor, Regressors,
                                         ResampledDataset)
 from Models.SavedModels import ForecastList
+from Utilities.DailyStore import DailyStore
+from Utilities.ForecastArchive import (ArchiveForecastReader, MappedSeries,
+                                       map_array, write_array)
 
 app = QApplication.instance()
 
+# Name of the pickled metadata in an archive forecast file
+ARCHIVE_METADATA = 'forecast.pkl'
+
+# Version of the SQLite forecast schema (stored as PRAGMA user_version).
+#   0: dataset data stored one value per row in "datasets_data"
+#   1: dataset data stored as compressed arrays in "datasets_series"
+SQLITE_SCHEMA_VERSION = 1
+
+# zlib compression level of the dataset data blobs
+BLOB_COMPRESSION = 1
+
+# The tables (and their guid column) of each kind of object in the database
+SQLITE_TABLES = {
+    'datasets': [
+        ('datasets', 'guid'),
+        ('datasets_series', 'dataset_guid')
+    ],
+    'model_configurations': [
+        ('model_configurations', 'guid'),
+        ('model_configurations_predictand', 'model_configuration_guid'),
+        ('model_configurations_predictors', 'model_configuration_guid'),
+        ('model_configurations_regressors', 'model_configuration_guid')
+    ],
+    'saved_models': [
+        ('saved_models', 'guid'),
+        ('saved_models_predictand', 'saved_model_guid'),
+        ('saved_models_predictors', 'saved_model_guid'),
+        ('saved_models_forecasts', 'saved_model_guid')
+    ]
+}
+
+# What was last saved to each SQLite database in this session:
+# {database path: {(kind, guid): signature}}
+_sqlite_saved = {}
+
+# Each dataset's data is one row: the first date, the pandas frequency and
+# number of values if the dates are regular ("dates" is NULL), or all the
+# dates otherwise. "present" marks the days that a daily series with gaps
+# actually has. All arrays are zlib-compressed little-endian bytes.
+DATASETS_SERIES_TABLE = """
+        CREATE TABLE datasets_series (
+            dataset_guid TEXT PRIMARY KEY REFERENCES datasets (guid),
+            start TEXT,
+            freq TEXT,
+            length INTEGER,
+            dates BLOB,
+            present BLOB,
+            data BLOB
+        );
+"""
+
 
 def file_version_less_than(v_file, v_check):
     """Checks if the file version is less than the check version"""
@@ -40,6 +101,11 @@ def sqlite_load_forecast(db: Path):
         app_info = cur.execute("SELECT * FROM app_info").fetchone()
         app_version = app_info['app_version']
 
+        # upgrade databases saved with an older schema
+        schema_version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version < SQLITE_SCHEMA_VERSION:
+            sqlite_migrate_datasets(cur)
+
         # load datasets
         sqlite_load_datasets(cur)
 
@@ -47,7 +113,10 @@ def sqlite_load_forecast(db: Path):
         sqlite_load_model_configurations(cur)
 
         # load saved models
-        sqlite_load_saved_models(cur)
+        sqlite_load_saved_models(cur, db)
+
+        # what's in the database now, so that the next save only writes changes
+        _sqlite_saved[str(db.resolve())] = sqlite_signatures()
 
     except Exception as e:
         print('Error reading forecast from SQLite database:')
@@ -59,7 +128,37 @@ def sqlite_load_forecast(db: Path):
             con.close()
 
 
-def sqlite_load_saved_models(cur: sqlite3.Cursor):
+class SQLiteForecastReader:
+    """Reads a saved model's forecasts from an SQLite forecast database, one
+    year at a time (see `ForecastList`)."""
+
+    def __init__(self, path, guid):
+
+        self.path = path
+        self.guid = guid
+
+    def read(self, year):
+        con = sqlite3.connect(self.path)
+        try:
+            rows = con.execute(
+                "SELECT exceedence, value FROM saved_models_forecasts "
+                "WHERE saved_model_guid=? AND year=? ORDER BY exceedence",
+                (self.guid, int(year))).fetchall()
+        finally:
+            con.close()
+
+        exceedances, values = zip(*rows) if rows else ((), ())
+        return pd.Series(values, index=pd.Index(exceedances, name='Exceedance'),
+                         name='Value', dtype=float)
+
+
+def sqlite_load_saved_models(cur: sqlite3.Cursor, db: Path):
+    # the forecasts themselves are only read when they're used
+    forecast_years = {}
+    for guid, year in cur.execute("SELECT DISTINCT saved_model_guid, year "
+                                  "FROM saved_models_forecasts").fetchall():
+        forecast_years.setdefault(guid, []).append(year)
+
     # note cur.execute().fetchall() is needed here given the other cur.execute()
     # which would otherwise clobber the in-memory rows
     for row in cur.execute("SELECT * FROM saved_models").fetchall():
@@ -102,20 +201,9 @@ def sqlite_load_saved_models(cur: sqlite3.Cursor):
             dataset.resample()
             sm_dict['predictors'].add_predictor(dataset)
 
-        forecast_list = ForecastList()
-        years, exceedences, values = [], [], []
-        data = cur.execute(
-            "SELECT year, exceedence, value FROM saved_models_forecasts "
-            "WHERE saved_model_guid=?", (f'{row['guid']}',))
-        for datarow in data:
-            years.append(datarow['year'])
-            exceedences.append(datarow['exceedence'])
-            values.append(datarow['value'])
-        forecast_list.forecasts = pd.DataFrame(
-            index=pd.MultiIndex.from_arrays([years, exceedences],
-                                            names=['Year', 'Exceedance']),
-            data=values, columns=['Value'])
-        sm_dict['forecast'] = forecast_list
+        sm_dict['forecast'] = ForecastList(
+            forecast_years.get(row['guid']),
+            SQLiteForecastReader(str(db.resolve()), row['guid']))
 
         app.saved_models.add_model(
             regression_model=sm_dict['regression_model'],
@@ -183,6 +271,9 @@ def sqlite_load_model_configurations(cur: sqlite3.Cursor):
 
 
 def sqlite_load_datasets(cur: sqlite3.Cursor):
+    series = {row['dataset_guid']: decode_series(row)
+              for row in cur.execute("SELECT * FROM datasets_series").fetchall()}
+
     # note cur.execute().fetchall() is needed here given the other cur.execute()
     # which would otherwise clobber the in-memory rows
     for row in cur.execute("SELECT * FROM datasets").fetchall():
@@ -190,23 +281,281 @@ def sqlite_load_datasets(cur: sqlite3.Cursor):
         ds_dict['dataloader'] = app.dataloaders[row['dataloader']]['CLASS']()
         ds_dict['raw_unit'] = app.units.get_unit(row['raw_unit'])
         ds_dict['display_unit'] = app.units.get_unit(row['display_unit'])
-
-        # Pandas.read_sql_query, Numpy, and SQLite rows were tested. Using the cur
-        # object was slighlty faster and arguably more readable and capable of large
-        # data reads.
-        dates, values = [], []
-        data = cur.execute("SELECT datetime, value FROM datasets_data "
-                           "WHERE dataset_guid=?", (f'{ds_dict['guid']}',))
-        for datarow in data:
-            dates.append(datarow['datetime'])
-            values.append(datarow['value'])
-        ds_dict['data'] = pd.Series(index=pd.to_datetime(dates), data=values,
-                                    name=ds_dict['guid'])
+        ds_dict['data'] = series.get(
+            row['guid'], pd.Series(index=pd.DatetimeIndex([]), dtype=float))
+        ds_dict['data'].name = row['guid']
 
         app.datasets.add_dataset(**ds_dict)
 
 
-def load_file(f):
+def sqlite_read_datasets_data(cur: sqlite3.Cursor):
+    """Reads the one-value-per-row "datasets_data" table of a version 0
+    database into a {dataset guid: series} dictionary."""
+
+    # Read the rows in large blocks of plain tuples, and convert each block
+    # to arrays at once
+    guids, dates, values = [], [], []
+    rows = cur.connection.cursor()
+    rows.execute("SELECT dataset_guid, datetime, value FROM datasets_data "
+                 "ORDER BY dataset_guid, datetime")
+    while True:
+        block = rows.fetchmany(1_000_000)
+        if not block:
+            break
+        block_guids, block_dates, block_values = zip(*block)
+        guids.append(np.array(block_guids, dtype=object))
+        dates.append(pd.to_datetime(np.array(block_dates), format='ISO8601').values)
+        values.append(pd.to_numeric(np.array(block_values, dtype=object),
+                                    errors='coerce').astype(np.float64))
+    rows.close()
+
+    if not guids:
+        return {}
+    guids = np.concatenate(guids)
+    dates = np.concatenate(dates)
+    values = np.concatenate(values)
+
+    # The rows are sorted by dataset, so each dataset is one slice
+    starts = np.flatnonzero(np.r_[True, guids[1:] != guids[:-1]])
+    ends = np.r_[starts[1:], len(guids)]
+
+    return {guids[s]: pd.Series(values[s:e], index=pd.DatetimeIndex(dates[s:e]),
+                                name=guids[s])
+            for s, e in zip(starts, ends)}
+
+
+def sqlite_migrate_datasets(cur: sqlite3.Cursor):
+    """Upgrades a version 0 database: moves the dataset data from
+    "datasets_data" into "datasets_series"."""
+
+    series = sqlite_read_datasets_data(cur)
+
+    # all or nothing
+    cur.execute("BEGIN")
+    try:
+        cur.execute(DATASETS_SERIES_TABLE)
+        cur.executemany("INSERT INTO datasets_series VALUES(?, ?, ?, ?, ?, ?, ?)",
+                        [(guid, *encode_series(s)) for guid, s in series.items()])
+        cur.execute("DROP TABLE datasets_data")
+        cur.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+    except Exception:
+        cur.connection.rollback()
+        raise
+    cur.connection.commit()
+
+
+def encode_series(series):
+    """Returns the (start, freq, length, dates, present, data) columns of the
+    "datasets_series" row for 'series'."""
+
+    def blob(array, dtype):
+        return zlib.compress(np.ascontiguousarray(array, dtype=dtype).tobytes(),
+                             BLOB_COMPRESSION)
+
+    if series.dtype.kind != 'f':
+        series = pd.to_numeric(series, errors='coerce').astype(np.float64)
+    if not isinstance(series.index, pd.DatetimeIndex):
+        series = series.set_axis(pd.to_datetime(series.index))
+
+    # Daily data (with or without gaps)
+    store = DailyStore.from_series(series)
+    if store is not None:
+        present = None if store.present is None else blob(
+            np.packbits(store.present), np.uint8)
+        return (str(store.first_date), 'D', len(store.values), None, present,
+                blob(store.values, '<f8'))
+
+    # Any other regular frequency
+    freq = pd.infer_freq(series.index) if len(series) > 2 else None
+    if freq is not None:
+        return (str(series.index[0]), freq, len(series), None, None,
+                blob(series.values, '<f8'))
+
+    return (None, None, len(series),
+            blob(series.index.values.astype('datetime64[ns]').view(np.int64), '<i8'),
+            None, blob(series.values, '<f8'))
+
+
+def decode_series(row):
+    """Builds the series stored in a "datasets_series" row."""
+
+    data = np.frombuffer(zlib.decompress(row['data']), dtype='<f8').astype(np.float64)
+
+    if row['dates'] is not None:
+        dates = np.frombuffer(zlib.decompress(row['dates']), dtype='<i8')
+        index = pd.DatetimeIndex(dates.astype('datetime64[ns]'))
+    elif row['length']:
+        index = pd.date_range(row['start'], periods=row['length'], freq=row['freq'])
+    else:
+        index = pd.DatetimeIndex([])
+
+    if row['present'] is not None:
+        present = np.unpackbits(np.frombuffer(zlib.decompress(row['present']),
+                                              dtype=np.uint8),
+                                count=len(data)).astype(bool)
+        index, data = index[present], data[present]
+
+    return pd.Series(data, index=index, name=row['dataset_guid'])
+
+
+def load_archive(path):
+    """Opens an archive forecast file (see `Utilities.ForecastArchive`). The
+    datasets' data is memory-mapped from the file rather than read."""
+
+    path = str(Path(path).resolve())
+    with zipfile.ZipFile(path) as zf:
+
+        def read_data(f):
+            stored = pickle.load(f)
+            if stored['kind'] == 'daily':
+                present = stored['present']
+                return DailyStore(
+                    stored['start'],
+                    map_array(path, zf, stored['values']),
+                    None if present is None else map_array(path, zf, present),
+                    stored['name'])
+            if stored['kind'] == 'series':
+                return MappedSeries(map_array(path, zf, stored['dates']),
+                                    map_array(path, zf, stored['values']),
+                                    stored['name'])
+            return stored['data']
+
+        # The forecasts of all the saved models are in the same arrays
+        forecast_arrays = {}
+
+        def read_forecasts(f):
+            stored = pickle.load(f)
+            if isinstance(stored, pd.DataFrame):
+                stored.index.names = ['Year', 'Exceedance']
+                forecasts = ForecastList()
+                forecasts.forecasts = stored
+                return forecasts
+            if not forecast_arrays:
+                forecast_arrays.update({
+                    column: map_array(path, zf, f'forecasts/{column}.npy')
+                    for column in ['year', 'exceedance', 'value']})
+            return ForecastList(stored['years'], ArchiveForecastReader(
+                path, forecast_arrays, stored['start'], stored['end']))
+
+        load_file(io.BytesIO(zf.read(ARCHIVE_METADATA)), read_data,
+                  read_forecasts)
+
+
+def save_archive(path):
+    """Saves the forecast to 'path' as an archive forecast file (see
+    `Utilities.ForecastArchive`).
+
+    The file is written next to 'path' and then moved over it, so that a
+    failed save doesn't destroy the existing file.
+    """
+
+    path = Path(path).resolve()
+    arrays = []
+
+    def write_data(dataset, f):
+        data = dataset.data
+        store = dataset.store
+        if store is None and data.dtype.kind == 'f':
+            store = DailyStore.from_series(data, data.dtype)
+        prefix = f'data/{dataset.guid}'
+
+        if store is not None:
+            arrays.append((f'{prefix}/values.npy', store.values))
+            if store.present is not None:
+                arrays.append((f'{prefix}/present.npy', store.present))
+            stored = {
+                'kind': 'daily',
+                'start': store.start,
+                'values': f'{prefix}/values.npy',
+                'present': None if store.present is None else f'{prefix}/present.npy',
+                'name': store.name
+            }
+        elif isinstance(data.index, pd.DatetimeIndex) and data.dtype.kind == 'f':
+            arrays.append((f'{prefix}/dates.npy',
+                           data.index.values.astype('datetime64[ns]')))
+            arrays.append((f'{prefix}/values.npy', data.values.astype(np.float64)))
+            stored = {
+                'kind': 'series',
+                'dates': f'{prefix}/dates.npy',
+                'values': f'{prefix}/values.npy',
+                'name': data.name
+            }
+        else:
+            stored = {'kind': 'pickle', 'data': data}
+
+        pickle.dump(stored, f, 4)
+
+    forecast_arrays = {'year': [], 'exceedance': [], 'value': []}
+    forecast_count = [0]
+
+    def write_forecasts(model, f):
+        year, exceedance, value = model.forecasts.arrays()
+        start = forecast_count[0]
+        forecast_count[0] += len(year)
+        forecast_arrays['year'].append(year)
+        forecast_arrays['exceedance'].append(exceedance)
+        forecast_arrays['value'].append(value)
+        pickle.dump({
+            'years': model.forecasts.years(),
+            'start': start,
+            'end': forecast_count[0]
+        }, f, 4)
+
+    metadata = io.BytesIO()
+    save_to_file(metadata, write_data, write_forecasts)
+    for column, values in forecast_arrays.items():
+        arrays.append((f'forecasts/{column}.npy',
+                       np.concatenate(values) if values else np.empty(0)))
+
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(temp_path, 'wb') as f:
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as zf:
+                zf.writestr(ARCHIVE_METADATA, metadata.getvalue())
+                for name, array in arrays:
+                    write_array(zf, f, name, array)
+        del arrays
+
+        release_mappings(path)
+        try:
+            os.replace(temp_path, path)
+        except PermissionError as e:
+            # e.g. on Windows, while arrays mapped from the file are still
+            # referenced somewhere
+            raise PermissionError(
+                f'Could not replace {path}, because data memory-mapped from '
+                f'it is still in use. Save the forecast to another file.'
+            ) from e
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def release_mappings(path):
+    """Reads everything that's memory-mapped from the forecast file 'path'
+    into memory, so that the file can be replaced (a mapped file can't be
+    replaced on Windows, and truncating it would pull the data out from
+    under the mapped arrays)."""
+
+    path = str(Path(path).resolve())
+    for dataset in app.datasets.datasets:
+        if dataset.mapped_file == path:
+            dataset.read_mapped_data()
+    for model in app.saved_models:
+        reader = model.forecasts.reader
+        if getattr(reader, 'path', None) == path:
+            model.forecasts.read_all()
+
+    # Free the (released) mapped arrays that are only referenced from
+    # reference cycles
+    gc.collect()
+
+
+def load_file(f, read_data=None, read_forecasts=None):
+    """Loads a pickle forecast file. 'read_data' reads a dataset's data from
+    'f' in place of `pd.read_pickle`, and 'read_forecasts' reads a saved
+    model's `ForecastList` (see `load_archive`)."""
+
     # Load the file version
     f_version = pickle.load(f)
 
@@ -228,6 +577,7 @@ def load_file(f):
 
         for dataset in datasets:
             app.datasets.datasets.append(dataset)
+            app.datasets.index_dataset(dataset)
             print(f'Added Dataset: {dataset}')
             app.datasets.insertRow(app.datasets.rowCount())
         app.datasets.dataChanged.emit(app.datasets.index(0),
@@ -247,7 +597,10 @@ def load_file(f):
                 dataset_dict['display_unit'])
             dataset_dict['dataloader'] = app.dataloaders[dataset_dict['dataloader']][
                 'CLASS']()
-            dataset_dict['data'] = pd.read_pickle(f, compression={'method': None})
+            if read_data is None:
+                dataset_dict['data'] = pd.read_pickle(f, compression={'method': None})
+            else:
+                dataset_dict['data'] = read_data(f)
 
             app.datasets.add_dataset(**dataset_dict)
 
@@ -283,10 +636,13 @@ def load_file(f):
             issue_date = pickle.load(f)
             name = pickle.load(f)
             comment = pickle.load(f)
-            forecasts = pickle.load(f)
-            forecasts.index.names = ['Year', 'Exceedance']
-            forecast_obj = ForecastList()
-            forecast_obj.forecasts = forecasts
+            if read_forecasts is None:
+                forecasts = pickle.load(f)
+                forecasts.index.names = ['Year', 'Exceedance']
+                forecast_obj = ForecastList()
+                forecast_obj.forecasts = forecasts
+            else:
+                forecast_obj = read_forecasts(f)
             app.saved_models.add_model(
                 regression_model=regression_model,
                 cross_validator=cross_validator,
@@ -303,10 +659,29 @@ def load_file(f):
             )
 
 
-def sqlite_save_forecast(db: Path):
+def sqlite_save_forecast(db: Path, compact=False):
+    """Saves the forecast to the SQLite database next to 'db'.
+
+    Only the datasets, model configurations and saved models that changed
+    since the forecast was last saved to the database (in this session) are
+    written, in one transaction on the existing file. The whole database is
+    rewritten (which also compacts it) when 'compact' is True, or when it
+    hasn't been saved in this session.
+    """
+
     # set database name to forecast file name with '.sqlite' extension
     db = db.with_suffix('.sqlite')
 
+    if not compact and str(db.resolve()) in _sqlite_saved and db.is_file():
+        sqlite_save_changes(db)
+        return
+
+    # the forecasts that are still in the database have to be read before
+    # it's replaced
+    for saved_model in app.saved_models:
+        if getattr(saved_model.forecasts.reader, 'path', None) == str(db.resolve()):
+            saved_model.forecasts.read_all()
+
     # if the database exists, back it up
     db_backup = Path(db.with_suffix('.sqlite.bak'))
     if db.is_file():
@@ -328,17 +703,20 @@ def sqlite_save_forecast(db: Path):
             cur.execute("INSERT INTO app_info VALUES (?, ?, ?, ?)", (
                 1, app.PYCAST_VERSION, app.PYTHON_VERSION, sqlite3.sqlite_version))
 
+            saved = {}
+
             # save datasets information
-            sqlite_save_datasets(cur)
+            sqlite_save_datasets(cur, saved)
 
             # save model configurations information
-            sqlite_save_model_configurations(cur)
+            sqlite_save_model_configurations(cur, saved)
 
             # save saved models information
-            sqlite_save_saved_models(cur)
+            sqlite_save_saved_models(cur, saved)
 
         # save in-memory database to disk
         cur.execute("VACUUM INTO ?", (str(db),))
+        _sqlite_saved[str(db.resolve())] = saved
 
         # delete database backup if it exists
         db_backup.unlink(missing_ok=True)
@@ -354,8 +732,119 @@ def sqlite_save_forecast(db: Path):
             con.close()
 
 
-def sqlite_save_saved_models(cur: sqlite3.Cursor):
-    smodels, smodels_predictands, smodels_predictors, smodels_forecasts = [], [], [], []
+def sqlite_save_changes(db: Path):
+    """Writes the objects that changed since the last save to the database
+    'db' (see `sqlite_save_forecast`)."""
+
+    key = str(db.resolve())
+    last_saved = _sqlite_saved.pop(key)
+    saved = {}
+
+    con = None
+    try:
+        con = sqlite3.connect(db)
+        cur = con.cursor()
+        cur.execute('PRAGMA foreign_keys = ON')
+
+        # all or nothing; a dataset can be rewritten while models refer to it
+        cur.execute('BEGIN')
+        cur.execute('PRAGMA defer_foreign_keys = ON')
+
+        cur.execute("UPDATE app_info SET app_version=?, py_version=?, db_version=? "
+                    "WHERE id=1", (app.PYCAST_VERSION, app.PYTHON_VERSION,
+                                   sqlite3.sqlite_version))
+
+        sqlite_save_datasets(cur, saved, last_saved)
+        sqlite_save_model_configurations(cur, saved, last_saved)
+        sqlite_save_saved_models(cur, saved, last_saved)
+
+        # remove the objects that no longer exist
+        for (kind, guid) in last_saved.keys() - saved.keys():
+            sqlite_delete(cur, kind, guid)
+
+        con.commit()
+        _sqlite_saved[key] = saved
+
+    except Exception as e:
+        if con:
+            con.rollback()
+        print('Error saving forecast to an SQLite database:')
+        print(f'{repr(e)}')
+
+    finally:
+        if con:
+            con.close()
+
+
+def sqlite_delete(cur: sqlite3.Cursor, kind, guid):
+    """Deletes a dataset, model configuration or saved model ('kind') from
+    all of its tables."""
+    for table, column in SQLITE_TABLES[kind]:
+        cur.execute(f"DELETE FROM {table} WHERE {column}=?", (guid,))
+
+
+def sqlite_write(cur: sqlite3.Cursor, kind, guid, rows, signature, saved,
+                 last_saved):
+    """Writes the rows ({table: [rows]}) of a dataset, model configuration or
+    saved model unless they're unchanged since they were last saved. 'rows'
+    may be a function returning them, so they're only built when needed.
+    With no cursor ('cur' is None), only the signature is recorded."""
+
+    saved[(kind, guid)] = signature
+    if cur is None or (last_saved is not None
+                       and last_saved.get((kind, guid)) == signature):
+        return
+
+    if callable(rows):
+        rows = rows()
+    if last_saved is not None:
+        sqlite_delete(cur, kind, guid)
+    for table, _ in SQLITE_TABLES[kind]:
+        if rows[table]:
+            cur.executemany(
+                f"INSERT INTO {table} VALUES({', '.join('?' * len(rows[table][0]))})",
+                rows[table])
+
+
+def sqlite_signatures():
+    """Returns the signatures of the objects as they'd be saved now (see
+    `sqlite_write`)."""
+
+    saved = {}
+    sqlite_save_datasets(None, saved)
+    sqlite_save_model_configurations(None, saved)
+    sqlite_save_saved_models(None, saved)
+
+    return saved
+
+
+def rows_signature(rows):
+    """Digest of a set of table rows, used to tell if they changed."""
+    return hashlib.blake2b(pickle.dumps(rows, 4), digest_size=16).digest()
+
+
+def row_guid(parent_guid, table, i):
+    """The guid of the i'th predictor / predictand / regressor row of a model
+    configuration or saved model. The same objects are shared between
+    configurations and models, so the guid is derived from the row, and is
+    the same every time the row is saved."""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f'{parent_guid}/{table}/{i}'))
+
+
+def resampled_dataset_row(dataset, parent_guid, table, i=0):
+    return [row_guid(parent_guid, table, i),
+            parent_guid,
+            dataset.dataset_guid,
+            dataset.agg_method,
+            int(dataset.forced),
+            int(dataset.mustBePositive),
+            dataset.preprocessing,
+            dataset.unit.id,
+            dataset.period_start.isoformat(),
+            dataset.period_end.isoformat()]
+
+
+def sqlite_save_saved_models(cur: sqlite3.Cursor, saved, last_saved=None):
     for saved_model in app.saved_models:
         model_values = [[saved_model.guid,
                          saved_model.name,
@@ -366,58 +855,33 @@ def sqlite_save_saved_models(cur: sqlite3.Cursor):
                          saved_model.regression_model,
                          saved_model.cross_validator,
                          saved_model.comment]]
-        smodels.extend(model_values)
-
-        predictand_values = [[str(uuid.uuid4())
-                              if not hasattr(saved_model.predictand, 'guid')
-                              else saved_model.predictand.guid,
-                              saved_model.guid,
-                              saved_model.predictand.dataset_guid,
-                              saved_model.predictand.agg_method,
-                              int(saved_model.predictand.forced),
-                              int(saved_model.predictand.mustBePositive),
-                              saved_model.predictand.preprocessing,
-                              saved_model.predictand.unit.id,
-                              saved_model.predictand.period_start.isoformat(),
-                              saved_model.predictand.period_end.isoformat()]]
-        smodels_predictands.extend(predictand_values)
-
-        for predictor in saved_model.predictors.predictors:
-            predictor_values = [[str(uuid.uuid4())
-                                 if not hasattr(predictor, 'guid')
-                                 else predictor.guid,
-                                 saved_model.guid,
-                                 predictor.dataset_guid,
-                                 predictor.agg_method,
-                                 int(predictor.forced),
-                                 int(predictor.mustBePositive),
-                                 predictor.preprocessing,
-                                 predictor.unit.id,
-                                 predictor.period_start.isoformat(),
-                                 predictor.period_end.isoformat()]]
-            smodels_predictors.extend(predictor_values)
-
-        forecast = saved_model.forecasts.forecasts
-        year = forecast.index.get_level_values('Year').values.flatten()
-        exc = forecast.index.get_level_values('Exceedance').values.flatten()
-        value = forecast.values.flatten()
-        data = [[saved_model.guid, x, y, z]
-                for x, y, z in
-                zip(year, exc, value)]
-        smodels_forecasts.extend(data)
-
-    cur.executemany("INSERT INTO saved_models "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", smodels)
-    cur.executemany("INSERT INTO saved_models_predictand "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", smodels_predictands)
-    cur.executemany("INSERT INTO saved_models_predictors "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", smodels_predictors)
-    cur.executemany("INSERT INTO saved_models_forecasts "
-                    "VALUES(?, ?, ?, ?)", smodels_forecasts)
-
-
-def sqlite_save_model_configurations(cur: sqlite3.Cursor):
-    configs, configs_predictands, configs_predictors, configs_regressors = [], [], [], []
+
+        predictand_values = [resampled_dataset_row(
+            saved_model.predictand, saved_model.guid, 'saved_models_predictand')]
+
+        predictor_values = [resampled_dataset_row(
+            predictor, saved_model.guid, 'saved_models_predictors', i)
+            for i, predictor in enumerate(saved_model.predictors.predictors)]
+
+        rows = {
+            'saved_models': model_values,
+            'saved_models_predictand': predictand_values,
+            'saved_models_predictors': predictor_values
+        }
+
+        # The forecasts are only read (and written) if their version changed
+        def forecast_rows(saved_model=saved_model, rows=rows):
+            year, exc, value = saved_model.forecasts.arrays()
+            return {**rows, 'saved_models_forecasts': [
+                [saved_model.guid, x, y, z]
+                for x, y, z in zip(year.tolist(), exc.tolist(), value.tolist())]}
+
+        sqlite_write(cur, 'saved_models', saved_model.guid, forecast_rows,
+                     (rows_signature(rows), saved_model.forecasts.version),
+                     saved, last_saved)
+
+
+def sqlite_save_model_configurations(cur: sqlite3.Cursor, saved, last_saved=None):
     for model_config in app.model_configurations.configurations:
         config_values = [[model_config.guid,
                           model_config.name,
@@ -426,82 +890,58 @@ def sqlite_save_model_configurations(cur: sqlite3.Cursor):
                           model_config.training_end_date.isoformat(),
                           ' '.join(str(x) for x in model_config.training_exclude_dates),
                           model_config.comment]]
-        configs.extend(config_values)
-
-        predictand_values = [[str(uuid.uuid4())
-                              if not hasattr(model_config.predictand, 'guid')
-                              else model_config.predictand.guid,
-                              model_config.guid,
-                              model_config.predictand.dataset_guid,
-                              model_config.predictand.agg_method,
-                              int(model_config.predictand.forced),
-                              int(model_config.predictand.mustBePositive),
-                              model_config.predictand.preprocessing,
-                              model_config.predictand.unit.id,
-                              model_config.predictand.period_start.isoformat(),
-                              model_config.predictand.period_end.isoformat()]]
-        configs_predictands.extend(predictand_values)
-
-        for predictor in model_config.predictor_pool.predictors:
-            predictor_values = [[str(uuid.uuid4())
-                                 if not hasattr(predictor, 'guid')
-                                 else predictor.guid,
-                                 model_config.guid,
-                                 predictor.dataset_guid,
-                                 predictor.agg_method,
-                                 int(predictor.forced),
-                                 int(predictor.mustBePositive),
-                                 predictor.preprocessing,
-                                 predictor.unit.id,
-                                 predictor.period_start.isoformat(),
-                                 predictor.period_end.isoformat()]]
-            configs_predictors.extend(predictor_values)
-
-        for regressor in model_config.regressors.regressors:
-            regressor_values = [[str(uuid.uuid4())
-                                 if not hasattr(regressor, 'guid')
-                                 else regressor.guid,
-                                 model_config.guid,
-                                 regressor.cross_validation,
-                                 regressor.feature_selection,
-                                 regressor.regression_model,
-                                 regressor.scoring_metric]]
-            configs_regressors.extend(regressor_values)
-
-    cur.executemany("INSERT INTO model_configurations "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?)", configs)
-    cur.executemany("INSERT INTO model_configurations_predictand "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", configs_predictands)
-    cur.executemany("INSERT INTO model_configurations_predictors "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", configs_predictors)
-    cur.executemany("INSERT INTO model_configurations_regressors "
-                    "VALUES(?, ?, ?, ?, ?, ?)", configs_regressors)
-
-
-def sqlite_save_datasets(cur: sqlite3.Cursor):
-    datasets, datasets_data = [], []
+
+        predictand_values = [resampled_dataset_row(
+            model_config.predictand, model_config.guid,
+            'model_configurations_predictand')]
+
+        predictor_values = [resampled_dataset_row(
+            predictor, model_config.guid, 'model_configurations_predictors', i)
+            for i, predictor in enumerate(model_config.predictor_pool.predictors)]
+
+        regressor_values = [[row_guid(model_config.guid,
+                                      'model_configurations_regressors', i),
+                             model_config.guid,
+                             regressor.cross_validation,
+                             regressor.feature_selection,
+                             regressor.regression_model,
+                             regressor.scoring_metric]
+                            for i, regressor in enumerate(
+                                model_config.regressors.regressors)]
+
+        rows = {
+            'model_configurations': config_values,
+            'model_configurations_predictand': predictand_values,
+            'model_configurations_predictors': predictor_values,
+            'model_configurations_regressors': regressor_values
+        }
+        sqlite_write(cur, 'model_configurations', model_config.guid, rows,
+                     rows_signature(rows), saved, last_saved)
+
+
+def sqlite_save_datasets(cur: sqlite3.Cursor, saved, last_saved=None):
     for dataset in app.datasets.datasets:
-        dataset_values = [[dataset.guid,
-                           dataset.external_id,
-                           dataset.agency,
-                           dataset.name,
-                           dataset.parameter,
-                           dataset.param_code,
-                           dataset.dataloader.NAME,
-                           dataset.raw_unit.id,
-                           dataset.display_unit.id,
-                           dataset.name2]]
-        datasets.extend(dataset_values)
-
-        data = [[dataset.guid, x, y]
-                for x, y in
-                zip(dataset.data.index.astype(str), dataset.data.values.flatten())]
-        datasets_data.extend(data)
-
-    cur.executemany("INSERT INTO datasets "
-                    "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", datasets)
-    cur.executemany("INSERT INTO datasets_data "
-                    "VALUES(?, ?, ?)", datasets_data)
+        dataset_values = [dataset.guid,
+                          dataset.external_id,
+                          dataset.agency,
+                          dataset.name,
+                          dataset.parameter,
+                          dataset.param_code,
+                          dataset.dataloader.NAME,
+                          dataset.raw_unit.id,
+                          dataset.display_unit.id,
+                          dataset.name2]
+
+        # The data only has to be encoded if its version changed
+        def rows(dataset=dataset, dataset_values=dataset_values):
+            return {
+                'datasets': [dataset_values],
+                'datasets_series': [(dataset.guid, *encode_series(dataset.data))]
+            }
+
+        sqlite_write(cur, 'datasets', dataset.guid, rows,
+                     (tuple(dataset_values), dataset.data_version), saved,
+                     last_saved)
 
 
 def sqlite_create_tables(cur: sqlite3.Cursor):
@@ -526,13 +966,6 @@ def sqlite_create_tables(cur: sqlite3.Cursor):
             name2 TEXT
         );
 
-        CREATE TABLE datasets_data (
-            dataset_guid TEXT REFERENCES datasets (guid), 
-            datetime TEXT, 
-            value REAL, 
-            UNIQUE (dataset_guid, datetime)
-        );
-        
         CREATE TABLE model_configurations (
             guid TEXT PRIMARY KEY,
             name TEXT,
@@ -621,13 +1054,20 @@ def sqlite_create_tables(cur: sqlite3.Cursor):
             year INTEGER,
             exceedence REAL,
             value REAL,
-            UNIQUE (saved_model_guid, exceedence)
+            UNIQUE (saved_model_guid, year, exceedence)
         );
+    """ + DATASETS_SERIES_TABLE + f"""
+        PRAGMA user_version = {SQLITE_SCHEMA_VERSION};
     """
     cur.executescript(sqlite_tables_script)
 
 
-def save_to_file(f):
+def save_to_file(f, write_data=None, write_forecasts=None):
+    """Saves the forecast as a pickle forecast file. 'write_data' writes a
+    dataset's data to 'f' in place of `pd.Series.to_pickle`, and
+    'write_forecasts' writes a saved model's forecasts in place of pickling
+    the DataFrame (see `save_archive`)."""
+
     pickle.dump(app.PYCAST_VERSION, f, 4)
 
     # Datasets
@@ -638,9 +1078,12 @@ def save_to_file(f):
         d['display_unit'] = d['display_unit'].id
         d['dataloader'] = d['dataloader'].NAME
         pickle.dump({
-            key: d[key] for key in d.keys() if key != 'data'
+            key: d[key] for key in d.keys() if key not in dataset._not_saved
         }, f, 4)
-        dataset.data.to_pickle(f, compression=None, protocol=4)
+        if write_data is None:
+            dataset.data.to_pickle(f, compression=None, protocol=4)
+        else:
+            write_data(dataset, f)
 
     # Model Configurations
     pickle.dump(len(app.model_configurations), f, 4)
@@ -678,5 +1121,8 @@ def save_to_file(f):
         pickle.dump(model.issue_date, f, 4)
         pickle.dump(model.name, f, 4)
         pickle.dump(model.comment, f, 4)
-        pickle.dump(model.forecasts.forecasts, f, 4)
+        if write_forecasts is None:
+            pickle.dump(model.forecasts.forecasts, f, 4)
+        else:
+            write_forecasts(model, f)
     # app.saved_models.save_to_file(f)
@@ -0,0 +1,145 @@
+"""
+ForecastArchive.py
+
+Helpers for the archive forecast file format.
+
+An archive forecast file is an uncompressed zip file. It holds the pickled
+metadata (datasets, model configurations and saved models) and one .npy
+file for each array of dataset data. Every .npy file is stored uncompressed
+and aligned in the zip file, so it can be memory-mapped straight from the
+forecast file. Opening a forecast then only reads the metadata, and a
+dataset's data is read from disk when it's first used.
+
+"MappedSeries" is the lazily-built data of a dataset that isn't stored as a
+`DailyStore`. The forecasts of all the saved models are stored as three
+arrays (year, exceedance, value), and "ArchiveForecastReader" reads one
+model's forecasts from them as they're used.
+"""
+
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Alignment of the array data in the zip file
+ALIGNMENT = 64
+
+# Zip "extra field" id used to pad local file headers (as used by zipalign)
+PADDING_HEADER_ID = 0xD935
+
+
+def write_array(zf, f, name, array):
+    """Writes 'array' to the zip file 'zf' as the .npy file 'name', padding the
+    local file header so that the array's data is aligned. 'f' is the file
+    object that 'zf' writes to."""
+
+    # The header is written where the previous file ended
+    offset = f.tell()
+    name_len = len(name.encode('utf-8'))
+    pad = -(offset + 30 + name_len + 4) % ALIGNMENT
+
+    zinfo = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.extra = struct.pack('<HH', PADDING_HEADER_ID, pad) + b'\0' * pad
+
+    # The .npy header is itself padded to a multiple of 64 bytes
+    with zf.open(zinfo, 'w') as entry:
+        np.lib.format.write_array(entry, np.ascontiguousarray(array),
+                                  allow_pickle=False)
+
+
+def map_array(path, zf, name):
+    """Returns the .npy file 'name' in the zip file 'zf' (opened from 'path')
+    as a read-only memory-mapped array."""
+
+    info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        with zf.open(info) as entry:
+            return np.lib.format.read_array(entry, allow_pickle=False)
+
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def mapped_file(array):
+    """Returns the name of the file that 'array' is memory-mapped from, or
+    None if it isn't memory-mapped."""
+
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap) and array.filename is not None:
+            return array.filename
+        array = array.base
+
+    return None
+
+
+class MappedSeries:
+    """A series of values at any dates, built from (memory-mapped) arrays of
+    its dates and values when it's first used."""
+
+    def __init__(self, dates, values, name=None):
+
+        self.dates = dates
+        self.values = values
+        self.name = name
+        self._series = None
+
+    @property
+    def nbytes(self):
+        return self.dates.nbytes + self.values.nbytes
+
+    def copy(self):
+        """Returns a MappedSeries with the data read into memory."""
+        return MappedSeries(np.array(self.dates), np.array(self.values), self.name)
+
+    def series(self):
+        """Returns the (read-only) pandas Series."""
+
+        if self._series is None:
+            values = np.asarray(self.values).view()
+            values.flags.writeable = False
+            self._series = pd.Series(values, index=pd.DatetimeIndex(self.dates),
+                                     name=self.name, copy=False)
+
+        return self._series
+
+
+class ArchiveForecastReader:
+    """Reads a saved model's forecasts, rows 'start' to 'end' of the
+    (memory-mapped) forecast 'arrays' of the archive at 'path', one year at a
+    time (see `ForecastList`)."""
+
+    def __init__(self, path, arrays, start, end):
+
+        self.path = path
+        self.arrays = arrays
+        self.start = start
+        self.end = end
+
+    def read(self, year):
+        rows = slice(self.start, self.end)
+        years = np.asarray(self.arrays['year'][rows])
+        selected = years == year
+
+        return pd.Series(
+            np.array(self.arrays['value'][rows][selected], dtype=np.float64),
+            index=pd.Index(np.array(self.arrays['exceedance'][rows][selected]),
+                           name='Exceedance'),
+            name='Value')
@@ -84,8 +84,7 @@ class ForecastDisaggregator(object):
             # iterate over all exceedances
             exc_list = [round(i * 4) / 4 for i in
                         np.arange(start=1.25, stop=100, step=2.5)]
-            for exc, val in self.forecasts.forecasts.loc[(year, slice(None))][
-                'Value'].items():
+            for exc, val in self.forecasts.get(year).items():
                 if exc * 100 not in exc_list:
                     continue
                 self.traces[year][exc] = OrderedDict()
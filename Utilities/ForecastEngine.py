@@ -0,0 +1,262 @@
+"""
+ForecastEngine.py
+
+Generates the forecasts of saved models without depending on the GUI, so
+that many (model, year) forecasts can be run across a pool of worker
+processes.
+
+"ForecastJob" holds everything that one forecast needs: the model's training
+data, its predictor values for the forecast year, its regressor and its
+predictand preprocessing.
+
+"bootstrap" fits a regression to bootstrap resamples of the training data.
+Linear regressors fit every resample at once as a stacked weighted least
+squares problem (see `batch_fit`); others are refit for each resample.
+
+"forecast" runs one job. It bootstraps the regression to build the .632+
+forecast distribution, and returns the forecast at each exceedance that
+saved models keep (see `PredictiveDistribution`).
+
+"ForecastEngine" runs a list of jobs, across a process pool when more than
+one worker is used, and reports each result through a callback as it
+completes.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from inspect import signature
+from multiprocessing import get_context
+
+import numpy as np
+
+from Resources.PreprocessingMethods import METHODS as PREPROCESSING_METHODS
+from Resources.RegressionModels import REGRESSORS
+from Utilities.PredictiveDistribution import sum_percentiles
+
+# Default number of bootstrap replicates for each forecast
+N_BOOTSTRAPS = 300
+
+# Default number of residual percentiles that the bootstrap forecasts are
+# combined with
+N_RESIDUALS = 100
+
+# Percentiles of the forecast distribution that are kept (one for each of
+# the saved models' exceedances)
+PERCENTILES = np.arange(1, 100, 0.25)
+
+# How often (in seconds) the engine calls its 'idle' callback while it waits
+# for worker processes
+POLL_SECONDS = 0.1
+
+
+class ForecastJob:
+    """One forecast: a saved model ('guid') forecasting 'year'."""
+
+    def __init__(self, guid, year, x_data, y_data, x_forecast, regression_model,
+                 cross_validator, preprocessing, params=None, pc_retain=None,
+                 n_bootstraps=N_BOOTSTRAPS, n_residuals=N_RESIDUALS,
+                 seed=None):
+        """Constructor
+
+        args:
+          guid (`str`) - guid of the saved model
+          year (`int`) - forecast year
+          x_data (`np.ndarray`) - training year x predictors matrix
+          y_data (`np.ndarray`) - training predictand values
+          x_forecast (`np.ndarray`) - predictor values for the forecast year
+          regression_model (`str`) - key into the REGRESSORS dictionary
+          cross_validator (`str`) - key into the CROSS_VALIDATION dictionary
+          preprocessing (`str`) - predictand preprocessing method name
+          params - parameters returned by the predictand preprocessing
+          pc_retain (`float`) - PC variance retention for PCR regressors
+          n_bootstraps (`int`) - number of bootstrap replicates
+          n_residuals (`int`) - number of residual percentiles
+          seed - seed for the bootstrap's random numbers (None for a random
+                 forecast every time)
+        """
+
+        self.guid = guid
+        self.year = year
+        self.x_data = x_data
+        self.y_data = y_data
+        self.x_forecast = x_forecast
+        self.regression_model = regression_model
+        self.cross_validator = cross_validator
+        self.preprocessing = preprocessing
+        self.params = params
+        self.pc_retain = pc_retain
+        self.n_bootstraps = n_bootstraps
+        self.n_residuals = n_residuals
+        self.seed = seed
+
+
+def bootstrap(regression_algorithm, x, y, x_forecast, n_bootstraps=N_BOOTSTRAPS,
+              seed=None):
+    """Fits 'regression_algorithm' to 'n_bootstraps' bootstrap resamples of
+    (x, y).
+
+    Returns the forecast of each fit for 'x_forecast', and the residuals of
+    each fit on the samples left out of its resample (out of bag), all
+    concatenated. Fits that fail (NaN forecast) are left out. 'seed' (a seed
+    or an `np.random.Generator`) seeds the resampling.
+    """
+
+    rng = seed if isinstance(seed, np.random.Generator) else (
+        np.random.default_rng(seed))
+    n = len(y)
+
+    # The number of times each sample is drawn into each resample
+    counts = rng.multinomial(n, np.full(n, 1 / n), size=n_bootstraps)
+    out_of_bag = counts == 0
+
+    if hasattr(regression_algorithm, 'batch_fit'):
+        coefs = regression_algorithm.batch_fit(x, y, counts)
+        fitted = coefs[:, 1:] @ x.T + coefs[:, :1]
+        forecasts = coefs[:, 1:] @ x_forecast + coefs[:, 0]
+    else:
+        fitted = np.empty((n_bootstraps, n))
+        forecasts = np.empty(n_bootstraps)
+        for b in range(n_bootstraps):
+            resample = np.repeat(np.arange(n), counts[b])
+            regression_algorithm.fit(x[resample], y[resample])
+            fitted[b] = regression_algorithm.predict(x)
+            forecasts[b] = np.asarray(
+                regression_algorithm.predict(x_forecast)).item()
+
+    fits = np.isfinite(forecasts)
+    if not fits.any():
+        raise ValueError('The regression could not be fitted to any bootstrap '
+                         'resample')
+
+    return forecasts[fits], (y - fitted)[out_of_bag & fits[:, None]]
+
+
+def forecast(job):
+    """Runs a ForecastJob, returning the forecast at each of PERCENTILES (in
+    the predictand's units)."""
+
+    regressor_class = REGRESSORS[job.regression_model]
+    kwargs = {'cross_validation': job.cross_validator}
+    if 'pc_retain' in signature(regressor_class).parameters:
+        kwargs['pc_retain'] = job.pc_retain
+    regression_algorithm = regressor_class(**kwargs)
+    x_data, predictand_data = job.x_data, job.y_data
+    rng = np.random.default_rng(job.seed)
+
+    bootstrap_predictions, validation_residuals = bootstrap(
+        regression_algorithm, x_data, predictand_data, job.x_forecast,
+        job.n_bootstraps, rng)
+    bootstrap_predictions -= np.mean(bootstrap_predictions)
+
+    regression_algorithm.fit(x_data, predictand_data)
+    predictions = regression_algorithm.predict(x_data)
+    forecast = regression_algorithm.predict(job.x_forecast)
+    train_residuals = predictand_data - predictions
+
+    levels = np.arange(job.n_residuals) * (100 / job.n_residuals)
+    validation_residuals = np.percentile(
+        validation_residuals, q=levels, method='linear')
+    train_residuals = np.percentile(
+        train_residuals, q=levels, method='linear')
+
+    no_information_error = np.mean(np.abs(
+        rng.permutation(predictand_data) - rng.permutation(predictions)))
+    generalisation = np.abs(
+        validation_residuals.mean() - train_residuals.mean())
+    no_information_val = np.abs(no_information_error - train_residuals)
+    relative_overfitting_rate = np.mean(generalisation / no_information_val)
+    weight = .632 / (1 - .368 * relative_overfitting_rate)
+    residuals = (1 - weight) * train_residuals + weight * validation_residuals
+    percentiles = sum_percentiles(
+        bootstrap_predictions, residuals, PERCENTILES) + forecast
+
+    method = PREPROCESSING_METHODS['INV_' + job.preprocessing]
+    if len(signature(method).parameters) > 1:
+        percentiles = method(percentiles, **job.params)
+    else:
+        percentiles = method(percentiles)
+
+    return np.asarray(percentiles, dtype=np.float64).ravel()
+
+
+def run_job(job):
+    """Pool task: runs a job, returning its (forecast, error message)."""
+
+    try:
+        return forecast(job), None
+    except Exception as e:
+        return None, repr(e)
+
+
+class ForecastEngine:
+    """Runs forecast jobs, across 'workers' processes when there's more than
+    one.
+
+    'progress(job, values, error)' is called (in the calling thread) as each
+    job completes, with the job's forecast values, or its error message if it
+    failed. 'idle()' is called between jobs, and periodically while waiting
+    for the worker processes, so that a GUI can keep processing events.
+    Calling `cancel` (e.g. from 'progress' or 'idle') stops the jobs that
+    haven't started yet.
+    """
+
+    def __init__(self, workers=1, progress=None, idle=None):
+
+        self.workers = max(1, int(workers))
+        self.progress = progress
+        self.idle = idle
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self, jobs):
+        """Runs 'jobs', returning a list of (forecast values, error message),
+        in the same order. Jobs that were cancelled return (None, None)."""
+
+        results = [(None, None)] * len(jobs)
+        self.cancelled = False
+
+        if self.workers == 1 or len(jobs) < 2:
+            for i, job in enumerate(jobs):
+                if self.cancelled:
+                    break
+                results[i] = run_job(job)
+                self.report(job, results[i])
+            return results
+
+        # Always spawn workers: forking a process that is running Qt threads
+        # is not safe.
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs)),
+                                 mp_context=get_context('spawn')) as executor:
+            pending = {executor.submit(run_job, job): i
+                       for i, job in enumerate(jobs)}
+            try:
+                while pending:
+                    done, _ = wait(pending, timeout=POLL_SECONDS,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = pending.pop(future)
+                        if future.cancelled():
+                            continue
+                        try:
+                            results[i] = future.result()
+                        except Exception as e:
+                            # e.g. a worker process died
+                            results[i] = None, repr(e)
+                        self.report(jobs[i], results[i])
+                    if self.idle is not None:
+                        self.idle()
+                    if self.cancelled:
+                        for future in pending:
+                            future.cancel()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        return results
+
+    def report(self, job, result):
+
+        if self.progress is not None:
+            self.progress(job, *result)
+        if self.idle is not None:
+            self.idle()
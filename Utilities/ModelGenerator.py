@@ -1,13 +1,12 @@
-from inspect import signature
 from itertools import compress
 
 import numpy as np
-import pandas as pd
 from PySide6.QtCore import QObject, Signal
 from PySide6.QtWidgets import QApplication
 
 from Models.SavedModels import Model
 from Utilities.HydrologyDateTimes import convert_to_water_year
+from Utilities.ParallelSearch import BATCH_SIZE, CHUNK_SIZE, GenomeScorer, SearchPool
 
 # Get the global application
 app = QApplication.instance()
@@ -30,6 +29,7 @@ class ModelGenerator(QObject):
         self.__id = id
         self.__abort = False
         self.config = selected_configuration
+        self.data = None
         self.use_list = False
         if external_list is not None:
             self.external_list = external_list
@@ -41,39 +41,40 @@ class ModelGenerator(QObject):
         positive_corr = np.array(
             [p.mustBePositive for p in self.config.predictor_pool.predictors])
 
+        # Predictors and predictand are only resampled if they changed since
+        # they were last used
         self.updateTextSignal.emit('Generating predictor and predictand data')
         for predictor in self.config.predictor_pool.predictors:
-            predictor.resample()
-            if not predictor.data.empty:
-                predictor.data = predictor.data.loc[
+            data = app.training_cache.resampled(predictor)
+            if not data.empty:
+                data = data.loc[
                     convert_to_water_year(self.config.training_start_date)
                     :convert_to_water_year(self.config.training_end_date)
                 ]
+            predictor.data = data
 
-        self.config.predictand.resample()
-        self.config.predictand.data = self.config.predictand.data.loc[
+        self.config.predictand.data = app.training_cache.resampled(
+            self.config.predictand).loc[
             convert_to_water_year(self.config.training_start_date)
             :convert_to_water_year(self.config.training_end_date)
         ]
 
         # Collate the predictor data into a numpy array
-        df = pd.DataFrame()
-        for predictor in self.config.predictor_pool.predictors:
-            df = pd.concat([df, predictor.data], axis=1)
-        df = pd.concat([df, self.config.predictand.data], axis=1).sort_index()
+        df = app.training_cache.collate(
+            self.config.guid,
+            self.config.predictor_pool.predictors,
+            self.config.predictand
+        )
         df = df.loc[
             convert_to_water_year(self.config.training_start_date)
             :convert_to_water_year(self.config.training_end_date)
         ]
         df = df.drop(self.config.training_exclude_dates, errors='ignore')
 
-        preproc_method = app.preprocessing_methods[
-            'INV_' + self.config.predictand.preprocessing
-        ]
-        if len(signature(preproc_method).parameters) > 1:
-            inverse_preproc_params = True
-        else:
-            inverse_preproc_params = False
+        # Also kept for feature selectors that look at the data themselves
+        data = df.to_numpy(dtype=float)
+        self.data = data
+        workers = max(1, int(app.settings.get('worker_processes', 1)))
 
         # Iterate over the regression methods
         for rr, regressor in enumerate(self.config.regressors):
@@ -81,9 +82,15 @@ class ModelGenerator(QObject):
             print("Beginning model search for regressor:"
                   f" {regressor.regression_model} / {regressor.scoring_metric}")
 
-            regression_algorithm = app.regressors[regressor.regression_model](
-                cross_validation=regressor.cross_validation)
-            scorer = app.scorers[regressor.scoring_metric]
+            scorer_kwargs = {
+                'positive_corr': positive_corr,
+                'regression_model': regressor.regression_model,
+                'cross_validation': regressor.cross_validation,
+                'scoring_metric': regressor.scoring_metric,
+                'preprocessing': self.config.predictand.preprocessing,
+                'params': getattr(self.config.predictand, 'params', None),
+                'pc_retain': app.settings['max_pc_mode_variance']
+            }
 
             # Check if we can brute force or not
             num_forced = sum([p.forced for p in self.config.predictor_pool.predictors])
@@ -108,101 +115,160 @@ class ModelGenerator(QObject):
 
             print('Starting feature selection with feature selector:'
                   f' {feature_selector_name}')
-            count = 0
             score_type = 1 if regressor.scoring_metric in ['R2', 'ADJ R2'] else 0
-            score = np.inf if score_type == 0 else -np.inf
-            while feature_selector.running or count == 0:
-
-                if self.__abort:
-                    self.stop()
-                    return
-
-                predictors = feature_selector.next(score, score_type)
-                past_prog = rr * (100 / len(self.config.regressors))
-                self.updateProgSignal.emit(
-                    int((past_prog + feature_selector.progress)
-                        / len(self.config.regressors))
-                )
-                if predictors <= 0:
-                    continue
-                bool_index = feature_selector.convert_int_to_array(
-                    predictors,
-                    feature_selector.num_predictors
-                )
 
-                genome = ''.join([u'\u25cf' if b else u'\u00B7' for b in bool_index])
-                genome = f'{genome:40.40}' if len(genome) < 40 else f'{genome:37.37}...'
-
-                run_data = df.iloc[:, bool_index + [True]].dropna()
-                if count % 10 == 0:
-                    app.processEvents()
-                if df.iloc[:, bool_index + [False]].dropna().empty:
-                    continue
-
-                x_data = run_data.values[:, :-1]
-                predictand_data = run_data.values[:, -1]
-                pos = positive_corr[bool_index]
-                y_p, y_a = regression_algorithm.cross_val_predict(
-                    x_data,
-                    predictand_data
-                )
+            # Feature selectors that can hand out batches of models are
+            # evaluated across a pool of worker processes, or with the
+            # regressor's batched kernel if it has one.
+            genome_scorer = GenomeScorer(data, **scorer_kwargs)
+            batches = hasattr(feature_selector, 'next_batch')
+            if batches and workers > 1:
+                print(f'Evaluating models with {workers} worker processes')
+                with SearchPool(data, workers, **scorer_kwargs) as pool:
+                    finished = self.batch_search(
+                        rr, regressor, feature_selector, score_type, pool,
+                        workers * CHUNK_SIZE)
+            elif batches and genome_scorer.batched:
+                finished = self.batch_search(
+                    rr, regressor, feature_selector, score_type, genome_scorer,
+                    BATCH_SIZE)
+            else:
+                finished = self.serial_search(
+                    rr, regressor, feature_selector, score_type, genome_scorer)
 
-                if all(np.isnan(y_p)):
-                    continue
-                if inverse_preproc_params:
-                    y_p = preproc_method(y_p, **self.config.predictand.params)
-                    y_a = preproc_method(y_a, **self.config.predictand.params)
-                else:
-                    y_p = preproc_method(y_p)
-                    y_a = preproc_method(y_a)
-                score_args = {
-                    'num_predictors': x_data.shape[1]
-                }
-                score = scorer(y_p, y_a, x_data.shape[1])
-                pos_param = regression_algorithm.is_positive_corr()
-                should_we_skip = False
-                for i, p in enumerate(pos):
-                    if p:
-                        if not pos_param[i]:
-                            should_we_skip = True
-                    else:
-                        pass
-                if np.isnan(score):
-                    should_we_skip = True
-                if should_we_skip:
-                    continue
-
-                model = Model(
-                    regression_model=regressor.regression_model,
-                    cross_validator=regressor.cross_validation,
-                    predictors=list(
-                        compress(self.config.predictor_pool.predictors, bool_index)),
-                    predictand=self.config.predictand,
-                    training_period_start=self.config.training_start_date,
-                    training_period_end=self.config.training_end_date,
-                    training_exclude_dates=self.config.training_exclude_dates,
-                    issue_date=self.config.issue_date,
-                    score=score,
-                    cross_validation=regressor.cross_validation,
-                    genome=bool_index,
-                    regressor=regressor,
-                    scorer=regressor.scoring_metric
-                )
+            if not finished:
+                self.stop()
+                return
 
-                self.updateTextSignal.emit(
-                    f'<b>{regressor.regression_model}</b><br>{genome}'
-                    f' Scorer ({regressor.scoring_metric}):'
-                    f' {score:+12.5f}'
-                    f' ({len(feature_selector.completed):>12}/{feature_selector.num_possible})')
+        self.stop()
+
+    def serial_search(self, rr, regressor, feature_selector, score_type,
+                      genome_scorer):
+        """Runs the feature selector one model at a time on this thread.
 
+        Returns False if the search was aborted.
+        """
+
+        count = 0
+        score = np.inf if score_type == 0 else -np.inf
+        while feature_selector.running or count == 0:
+
+            if self.__abort:
+                return False
+
+            # The selector finished without a model being kept
+            if not feature_selector.running and feature_selector.progress == 100:
+                break
+
+            predictors = feature_selector.next(score, score_type)
+            self.update_progress(rr, feature_selector)
+            if predictors <= 0:
                 app.processEvents()
-                if self.use_list:
-                    self.external_list.append(model)
-                else:
-                    self.newModelSignal.emit(model)
-                count += 1
+                continue
+            bool_index = feature_selector.convert_int_to_array(
+                predictors,
+                feature_selector.num_predictors
+            )
 
-        self.stop()
+            if count % 10 == 0:
+                app.processEvents()
+            new_score, keep = genome_scorer.score(bool_index)
+            if new_score is not None:
+                score = new_score
+            if not keep:
+                continue
+
+            self.report_model(regressor, feature_selector, bool_index, score)
+            app.processEvents()
+            count += 1
+
+        return True
+
+    def batch_search(self, rr, regressor, feature_selector, score_type,
+                     pool, batch_size):
+        """Runs the feature selector in batches, scoring each batch of models
+        with 'pool' (a SearchPool, or a GenomeScorer for a batched regressor).
+
+        Returns False if the search was aborted.
+        """
+
+        scores = None
+        while True:
+
+            if self.__abort:
+                return False
+
+            batch = feature_selector.next_batch(scores, score_type, batch_size)
+            self.update_progress(rr, feature_selector)
+            if not batch:
+                break
+
+            # Scores go back to the selector in the order it gave the models
+            scores = [None] * len(batch)
+            valid = [i for i, predictors in enumerate(batch) if predictors > 0]
+            genomes = [
+                feature_selector.convert_int_to_array(
+                    batch[i],
+                    feature_selector.num_predictors
+                ) for i in valid
+            ]
+
+            # e.g. a step with no new model, or a slice of the branch and bound
+            if not genomes:
+                app.processEvents()
+                continue
+
+            results = pool.score_genomes(genomes)
+            for i, bool_index, (score, keep) in zip(valid, genomes, results):
+                scores[i] = score
+                if keep:
+                    self.report_model(regressor, feature_selector, bool_index, score)
+            app.processEvents()
+
+        return True
+
+    def update_progress(self, rr, feature_selector):
+
+        past_prog = rr * (100 / len(self.config.regressors))
+        self.updateProgSignal.emit(
+            int((past_prog + feature_selector.progress)
+                / len(self.config.regressors))
+        )
+
+    def report_model(self, regressor, feature_selector, bool_index, score):
+        """Creates a model from a scored genome and sends it to the saved
+        models list (or the external list)."""
+
+        genome = ''.join([u'\u25cf' if b else u'\u00B7' for b in bool_index])
+        genome = f'{genome:40.40}' if len(genome) < 40 else f'{genome:37.37}...'
+
+        model = Model(
+            regression_model=regressor.regression_model,
+            cross_validator=regressor.cross_validation,
+            predictors=list(
+                compress(self.config.predictor_pool.predictors, bool_index)),
+            predictand=self.config.predictand,
+            training_period_start=self.config.training_start_date,
+            training_period_end=self.config.training_end_date,
+            training_exclude_dates=self.config.training_exclude_dates,
+            issue_date=self.config.issue_date,
+            score=score,
+            cross_validation=regressor.cross_validation,
+            genome=bool_index,
+            regressor=regressor,
+            scorer=regressor.scoring_metric
+        )
+
+        self.updateTextSignal.emit(
+            f'<b>{regressor.regression_model}</b><br>{genome}'
+            f' Scorer ({regressor.scoring_metric}):'
+            f' {score:+12.5f}'
+            f' ({len(feature_selector.completed):>12}/{feature_selector.num_possible})')
+
+        if self.use_list:
+            self.external_list.append(model)
+        else:
+            self.newModelSignal.emit(model)
 
     def abort(self):
         self.__abort = True
@@ -0,0 +1,236 @@
+"""
+ParallelSearch.py
+
+Contains the pieces of the model search that do not depend on the GUI, so
+that predictor subsets ("genomes") can be cross-validated and scored either
+on the model generator thread or inside a pool of worker processes.
+
+"GenomeScorer" evaluates a single genome against the collated
+predictor/predictand matrix (the predictand is the last column).
+
+"SearchPool" copies the collated matrix into shared memory once, starts a
+process pool whose workers each build their own GenomeScorer on top of that
+shared matrix, and scores batches of genomes across the workers.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from inspect import signature
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from Resources.PreprocessingMethods import METHODS as PREPROCESSING_METHODS
+from Resources.RegressionModels import REGRESSORS
+from Resources.ScoringMetrics import SCORERS
+
+# Number of genomes sent to a worker process in a single task
+CHUNK_SIZE = 16
+
+# Number of genomes scored per batch when a batched regressor is searched
+# without a process pool
+BATCH_SIZE = 256
+
+# Per-process state for pool workers (set by `init_worker`)
+_worker_shm = None
+_worker_scorer = None
+
+
+class GenomeScorer:
+    """Cross-validates and scores predictor subsets for one regressor."""
+
+    def __init__(self, data, positive_corr, regression_model, cross_validation,
+                 scoring_metric, preprocessing, params=None, pc_retain=None):
+        """Constructor
+
+        args:
+          data (`np.ndarray`) - year x (predictors + predictand) matrix
+          positive_corr (`np.ndarray`) - which predictors must be positively
+                                         correlated with the predictand
+          regression_model (`str`) - key into the REGRESSORS dictionary
+          cross_validation (`str`) - key into the CROSS_VALIDATION dictionary
+          scoring_metric (`str`) - key into the SCORERS dictionary
+          preprocessing (`str`) - predictand preprocessing method name
+          params - parameters returned by the predictand preprocessing
+          pc_retain (`float`) - PC variance retention for PCR regressors
+        """
+
+        self.data = data
+        self.positive_corr = positive_corr
+
+        # Re-used for the predictions of every genome
+        self.buffer = np.empty(len(data))
+
+        regressor_class = REGRESSORS[regression_model]
+        kwargs = {'cross_validation': cross_validation}
+        if 'pc_retain' in signature(regressor_class).parameters:
+            kwargs['pc_retain'] = pc_retain
+        self.regression_algorithm = regressor_class(**kwargs)
+        self.scorer = SCORERS[scoring_metric]
+
+        self.preproc_method = PREPROCESSING_METHODS['INV_' + preprocessing]
+        self.inverse_preproc_params = (
+            len(signature(self.preproc_method).parameters) > 1)
+        self.preproc_params = params
+
+    def score(self, bool_index):
+        """Scores the genome given by 'bool_index'.
+
+        Returns a (score, keep) tuple. 'score' is None when the genome could not
+        be cross-validated at all, and 'keep' is False when the resulting model
+        should not be reported (NaN score, or a predictor that must be
+        positively correlated came out negative).
+        """
+
+        bool_index = np.asarray(bool_index, dtype=bool)
+        x_cols = self.data[:, :-1][:, bool_index]
+        predictor_rows = ~np.isnan(x_cols).any(axis=1)
+        if not predictor_rows.any():
+            return None, False
+        run_rows = predictor_rows & ~np.isnan(self.data[:, -1])
+
+        y_p, y_a = self.regression_algorithm.cross_val_predict(
+            x_cols[run_rows],
+            self.data[run_rows, -1],
+            out=self.buffer
+        )
+
+        return self.evaluate(bool_index, y_p, y_a,
+                             self.regression_algorithm.is_positive_corr())
+
+    def evaluate(self, bool_index, y_p, y_a, pos_param):
+        """Scores one genome's cross-validated predictions."""
+
+        if np.isnan(y_p).all():
+            return None, False
+        if self.inverse_preproc_params:
+            y_p = self.preproc_method(y_p, **self.preproc_params)
+            y_a = self.preproc_method(y_a, **self.preproc_params)
+        else:
+            y_p = self.preproc_method(y_p)
+            y_a = self.preproc_method(y_a)
+
+        score = self.scorer(y_p, y_a, int(bool_index.sum()))
+        if np.isnan(score):
+            return score, False
+
+        for i, p in enumerate(self.positive_corr[bool_index]):
+            if p and not pos_param[i]:
+                return score, False
+
+        return score, True
+
+    def score_batch(self, genomes):
+        """Scores many genomes with the regressor's batched kernel.
+
+        Genomes are grouped by the rows that remain once missing data is
+        dropped, and each group is cross-validated in one call.
+        """
+
+        if not len(genomes):
+            return []
+
+        genomes = np.asarray(genomes, dtype=bool).reshape(len(genomes), -1)
+        results = [(None, False)] * len(genomes)
+
+        valid = ~np.isnan(self.data)
+        groups = {}
+        for g, bool_index in enumerate(genomes):
+            predictor_rows = valid[:, :-1][:, bool_index].all(axis=1)
+            if not predictor_rows.any():
+                continue
+            run_rows = predictor_rows & valid[:, -1]
+            groups.setdefault(run_rows.tobytes(), (run_rows, []))[1].append(g)
+
+        for run_rows, members in groups.values():
+            y_p, y_a, coefs = self.regression_algorithm.batch_cross_val_predict(
+                self.data[run_rows, :-1],
+                self.data[run_rows, -1],
+                genomes[members],
+                rows_key=run_rows.tobytes()
+            )
+            for i, g in enumerate(members):
+                results[g] = self.evaluate(
+                    genomes[g], y_p[i], y_a, coefs[i][1:] >= 0)
+
+        return results
+
+    @property
+    def batched(self):
+        """True if the regressor can cross-validate many genomes at once."""
+        return hasattr(self.regression_algorithm, 'batch_cross_val_predict')
+
+    def score_genomes(self, genomes):
+        """Scores a list of boolean genomes, returning a list of (score, keep)."""
+        if self.batched:
+            return self.score_batch(genomes)
+        return [self.score(bool_index) for bool_index in genomes]
+
+
+def init_worker(shm_name, shape, scorer_kwargs):
+    """Attaches a pool worker to the shared predictor/predictand matrix."""
+
+    global _worker_shm, _worker_scorer
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+    _worker_scorer = GenomeScorer(data, **scorer_kwargs)
+
+
+def score_genomes(genomes):
+    """Pool task: scores a chunk of genomes with this worker's GenomeScorer."""
+    return _worker_scorer.score_genomes(genomes)
+
+
+class SearchPool:
+    """Scores batches of genomes across a pool of worker processes.
+
+    Use as a context manager so that the process pool and the shared memory
+    block are always released:
+
+        with SearchPool(data, 8, **scorer_kwargs) as pool:
+            results = pool.score_genomes(genomes)
+    """
+
+    def __init__(self, data, workers, **scorer_kwargs):
+
+        self.data = np.ascontiguousarray(data, dtype=np.float64)
+        self.workers = workers
+        self.scorer_kwargs = scorer_kwargs
+        self.shm = None
+        self.executor = None
+
+    def __enter__(self):
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(self.data.nbytes, 1))
+        shared = np.ndarray(self.data.shape, dtype=np.float64, buffer=self.shm.buf)
+        shared[:] = self.data
+
+        # Always spawn workers: forking a process that is running Qt threads
+        # is not safe.
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context('spawn'),
+            initializer=init_worker,
+            initargs=(self.shm.name, self.data.shape, self.scorer_kwargs)
+        )
+
+        return self
+
+    def score_genomes(self, genomes):
+        """Scores the boolean genomes in order, returning a list of (score, keep)."""
+
+        chunks = [genomes[i:i + CHUNK_SIZE]
+                  for i in range(0, len(genomes), CHUNK_SIZE)]
+        results = []
+        for chunk_results in self.executor.map(score_genomes, chunks):
+            results.extend(chunk_results)
+
+        return results
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.shm.close()
+        self.shm.unlink()
+
+        return False
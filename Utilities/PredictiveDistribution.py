@@ -0,0 +1,166 @@
+"""
+PredictiveDistribution.py
+
+Percentiles of a forecast's predictive distribution.
+
+A forecast's predictive distribution is the distribution of every sum of a
+(centred) bootstrap forecast and a residual. "sum_percentiles" returns its
+percentiles, as `np.percentile` (linear method) would for the array of all
+len(a) x len(b) sums, without a Python loop over the sums.
+
+Up to MAX_BROADCAST sums are built by broadcasting and partitioned. Beyond
+that, only the order statistics that the percentiles need are selected
+from the two sorted marginals, as rows of sorted sums: the sums below a
+value are counted row by row with `np.searchsorted`, each order statistic
+is bracketed between values whose counts straddle its rank, and the
+brackets are narrowed until the order statistic can be picked from the
+few sums left in its bracket. Memory then grows with len(a) + len(b)
+rather than their product.
+"""
+
+import numpy as np
+
+# Largest number of sums that are built by broadcasting
+MAX_BROADCAST = 2 ** 22
+
+# Largest number of sums gathered from an order statistic's bracket
+MAX_BRACKET = 2 ** 10
+
+# Number of elements of each marginal whose sums place the first brackets
+SAMPLE = 256
+
+
+def sum_percentiles(a, b, q):
+    """Returns the 'q' percentiles of every sum of an element of 'a' and an
+    element of 'b' (both finite)."""
+
+    a = np.asarray(a, dtype=np.float64).ravel()
+    b = np.asarray(b, dtype=np.float64).ravel()
+    q = np.asarray(q, dtype=np.float64)
+
+    if a.size * b.size <= MAX_BROADCAST:
+        return np.percentile((a[:, None] + b[None, :]).ravel(), q=q)
+
+    # Count row by row along the shorter marginal
+    if len(a) > len(b):
+        a, b = b, a
+    a, b = np.sort(a), np.sort(b)
+
+    # The order statistics on either side of each percentile (as
+    # np.percentile's linear method)
+    virtual = (q / 100) * (a.size * b.size - 1)
+    previous = np.floor(virtual).astype(np.int64)
+    following = np.minimum(previous + 1, a.size * b.size - 1)
+    gamma = virtual - previous
+
+    ranks, positions = np.unique(np.concatenate((previous, following)),
+                                 return_inverse=True)
+    values = order_statistics(a, b, ranks)[positions]
+    lower, upper = values[:q.size], values[q.size:]
+
+    # np.percentile's interpolation
+    diff = upper - lower
+    percentiles = np.where(gamma >= 0.5, upper - diff * (1 - gamma),
+                           lower + diff * gamma)
+
+    return percentiles.reshape(q.shape)
+
+
+def row_counts(a, b, values):
+    """Returns, for each of 'values' (rows) and each element of 'a'
+    (columns), the number of sums of that element and an element of 'b'
+    that are <= the value. 'a' and 'b' are sorted."""
+
+    n = len(b)
+    counts = np.searchsorted(b, values[:, None] - a[None, :], side='right')
+
+    # 'value - a' is rounded, so correct the counts against the sums
+    # themselves (which increase along each row, as 'b' does)
+    while True:
+        under = counts < n
+        over = (a[None, :] + b[np.minimum(counts, n - 1)]) <= values[:, None]
+        up = under & over
+        down = (counts > 0) & (
+            (a[None, :] + b[np.maximum(counts - 1, 0)]) > values[:, None])
+        if not up.any() and not down.any():
+            return counts
+        counts = counts + up - down
+
+
+def order_statistics(a, b, ranks):
+    """Returns the 'ranks' order statistics (0 for the smallest) of every sum
+    of an element of 'a' and an element of 'b'. 'a' and 'b' are sorted."""
+
+    ranks = np.asarray(ranks, dtype=np.int64)
+
+    # Bracket each order statistic in (low, high], so that fewer than
+    # rank + 1 sums are <= low and at least rank + 1 are <= high, starting
+    # from the percentiles of the sums of a subsample of each marginal
+    sample = np.add.outer(a[np.linspace(0, len(a) - 1, SAMPLE).astype(int)],
+                          b[np.linspace(0, len(b) - 1, SAMPLE).astype(int)])
+    grid = np.unique(np.concatenate((
+        [np.nextafter(a[0] + b[0], -np.inf), a[-1] + b[-1]],
+        np.percentile(sample.ravel(), np.linspace(0, 100, SAMPLE * 4)))))
+    grid_counts = row_counts(a, b, grid)
+    above = np.searchsorted(grid_counts.sum(axis=1), ranks, side='right')
+
+    low, high = grid[above - 1], grid[above]
+    low_counts, high_counts = grid_counts[above - 1], grid_counts[above]
+    done = np.zeros(len(ranks), dtype=bool)
+
+    while True:
+        sizes = high_counts - low_counts
+        narrowing = ~done & (sizes.sum(axis=1) > MAX_BRACKET)
+        if not narrowing.any():
+            break
+        rows = np.flatnonzero(narrowing)
+
+        # Pivot on the weighted median of the middle sums of each row of
+        # the bracket, which leaves at least a quarter of the bracket's
+        # sums on either side
+        sizes = sizes[rows]
+        middles = a[None, :] + b[np.minimum(low_counts[rows] + sizes // 2,
+                                            len(b) - 1)]
+        middles[sizes == 0] = np.inf
+        order = np.argsort(middles, axis=1)
+        weights = np.cumsum(np.take_along_axis(sizes, order, axis=1), axis=1)
+        median = np.argmax(weights * 2 >= weights[:, -1:], axis=1)
+        pivots = middles[np.arange(len(rows)),
+                         order[np.arange(len(rows)), median]]
+
+        # A pivot at the top of its bracket (i.e. a tie) is either the order
+        # statistic, or the bracket's top can come down to the next float
+        tied = pivots >= high[rows]
+        pivots[tied] = np.nextafter(high[rows][tied], -np.inf)
+
+        counts = row_counts(a, b, pivots)
+        is_above = counts.sum(axis=1) > ranks[rows]
+        done[rows[tied & ~is_above]] = True
+
+        moved = rows[is_above]
+        high[moved] = pivots[is_above]
+        high_counts[moved] = counts[is_above]
+        moved = rows[~is_above & ~tied]
+        low[moved] = pivots[~is_above & ~tied]
+        low_counts[moved] = counts[~is_above & ~tied]
+
+    # Gather the sums in each bracket (that isn't known to be its top)
+    sizes = high_counts - low_counts
+    sizes[done] = 0
+    totals = sizes.sum(axis=1)
+
+    lengths = sizes.ravel()
+    starts = np.cumsum(lengths) - lengths
+    columns = np.repeat(np.arange(sizes.size) % len(a), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(starts, lengths)
+    sums = a[columns] + b[np.repeat(low_counts.ravel(), lengths) + offsets]
+
+    # Sort the gathered sums within each bracket and pick the order statistic
+    brackets = np.repeat(np.arange(len(ranks)), totals)
+    sums = sums[np.lexsort((sums, brackets))]
+    picks = np.cumsum(totals) - totals + (ranks - low_counts.sum(axis=1))
+
+    statistics = high.copy()
+    statistics[~done] = sums[picks[~done]]
+
+    return statistics
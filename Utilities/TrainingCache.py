@@ -0,0 +1,166 @@
+"""
+TrainingCache.py
+
+Keeps the resampled predictor / predictand data and the collated
+year x (predictors + predictand) DataFrames that the model generator, the
+forecast viewer and the forecast generator all build, so that opening a
+model or forecasting with it doesn't redo identical resampling.
+
+A resampled series is reused for as long as its ResampledDataset's period,
+aggregation, unit and preprocessing, and the underlying Dataset's data
+version and display unit, are unchanged. A collated frame is reused for as long as
+every one of its series is.
+
+"RESAMPLE_MEMO" is shared by every ResampledDataset in the process, so
+that the same predictor defined in many configurations and saved models
+(same dataset, period, aggregation, unit and preprocessing) is only
+resampled once for as long as the dataset's data version is unchanged.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+
+import pandas as pd
+from PySide6.QtWidgets import QApplication
+
+app = QApplication.instance()
+
+# Number of resampled series and collated frames kept
+RESAMPLE_CACHE_SIZE = 1024
+TRAINING_CACHE_SIZE = 64
+
+
+def resample_signature(resampled_dataset):
+    """Everything that the result of `ResampledDataset.resample` depends on."""
+
+    dataset = resampled_dataset.dataset()
+
+    return (
+        resampled_dataset.dataset_guid,
+        dataset.data_version,
+        resampled_dataset.period_start,
+        resampled_dataset.period_end,
+        resampled_dataset.agg_method,
+        getattr(resampled_dataset.unit, 'id', resampled_dataset.unit),
+        resampled_dataset.preprocessing,
+        getattr(dataset.display_unit, 'id', dataset.display_unit)
+    )
+
+
+class ResampleMemo:
+    """Least recently used store of resampled series, limited to the
+    "resample_memo_mb" setting (in megabytes)."""
+
+    def __init__(self):
+
+        # key -> (series, preprocessing parameters, size in bytes)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    @staticmethod
+    def key(resampled_dataset):
+        """Memo key for resampling 'resampled_dataset' with its dataset's
+        current data."""
+        return resample_signature(resampled_dataset)
+
+    def get(self, key):
+        """Returns a copy of the (series, parameters) stored under 'key', or
+        None."""
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+
+        return entry[0].copy(), deepcopy(entry[1])
+
+    def put(self, key, series, params=None):
+        """Stores a copy of a resampled series and its preprocessing
+        parameters, evicting the least recently used entries as needed."""
+
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[2]
+
+        series = series.copy()
+        nbytes = int(series.memory_usage(index=True, deep=True))
+        self.entries[key] = (series, deepcopy(params), nbytes)
+        self.nbytes += nbytes
+
+        limit = app.settings.get('resample_memo_mb', 64) * 2 ** 20
+        while self.nbytes > limit and self.entries:
+            self.nbytes -= self.entries.popitem(last=False)[1][2]
+
+    def clear(self):
+
+        self.entries.clear()
+        self.nbytes = 0
+
+
+RESAMPLE_MEMO = ResampleMemo()
+
+
+class TrainingCache:
+
+    def __init__(self):
+
+        # id(ResampledDataset) -> (resampled dataset, signature, series)
+        self.series = OrderedDict()
+
+        # guid -> (series used, DataFrame)
+        self.frames = OrderedDict()
+
+    def resampled(self, resampled_dataset):
+        """Returns the resampled data for 'resampled_dataset', resampling only
+        if it (or its dataset) changed since it was last resampled."""
+
+        key = id(resampled_dataset)
+        signature = resample_signature(resampled_dataset)
+
+        entry = self.series.get(key)
+        if (entry is not None and entry[0] is resampled_dataset
+                and entry[1] == signature):
+            self.series.move_to_end(key)
+            return entry[2]
+
+        resampled_dataset.resample()
+        self.series[key] = (resampled_dataset, signature,
+                            resampled_dataset.data)
+        self.series.move_to_end(key)
+        if len(self.series) > RESAMPLE_CACHE_SIZE:
+            self.series.popitem(last=False)
+
+        return resampled_dataset.data
+
+    def collate(self, guid, predictors, predictand):
+        """Returns the year x (predictors + predictand) DataFrame for the model
+        or configuration 'guid', with the predictand in the last column.
+
+        The frame is shared between callers, so it must not be modified in
+        place.
+        """
+
+        series = [self.resampled(p) for p in predictors]
+        series.append(self.resampled(predictand))
+
+        entry = self.frames.get(guid)
+        if entry is not None and len(entry[0]) == len(series) and all(
+                a is b for a, b in zip(entry[0], series)):
+            self.frames.move_to_end(guid)
+            return entry[1]
+
+        df = pd.concat(series, axis=1, keys=range(len(series))).sort_index()
+        self.frames[guid] = (series, df)
+        self.frames.move_to_end(guid)
+        if len(self.frames) > TRAINING_CACHE_SIZE:
+            self.frames.popitem(last=False)
+
+        return df
+
+    def discard(self, guid):
+        """Forgets the collated frame for a removed model or configuration."""
+        self.frames.pop(guid, None)
+
+    def clear(self):
+
+        self.series.clear()
+        self.frames.clear()
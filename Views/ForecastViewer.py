@@ -48,10 +48,9 @@ class ForecastViewer(QDialog):
         self.setWindowIcon(app.icon)
         self.fcst_idx = fcst_idx
         self.model = app.saved_models[fcst_idx.row()]
-        self.min_forecast_year = (
-            self.model.forecasts.forecasts.index.get_level_values(0).min())
-        self.max_forecast_year = (
-            self.model.forecasts.forecasts.index.get_level_values(0).max())
+        years = self.model.forecasts.years()
+        self.min_forecast_year = min(years, default=np.nan)
+        self.max_forecast_year = max(years, default=np.nan)
         self.regression_algorithm = (
             app.regressors[self.model.regression_model](cross_validation=self.model.cross_validator))
         self.setUI2()
@@ -80,10 +79,8 @@ class ForecastViewer(QDialog):
         year = e.sand_year_select.value()
         e.sand_ta.appendPlainText('Predictors:')
 
-        df = pd.DataFrame()
-        for predictor in self.model.predictors:
-            df = pd.concat([df, predictor.data], axis=1)
-        df = pd.concat([df, self.model.predictand.data], axis=1).sort_index()
+        df = app.training_cache.collate(
+            self.model.guid, self.model.predictors, self.model.predictand)
         df = df.loc[convert_to_water_year(
             self.model.training_period_start):convert_to_water_year(
             self.model.training_period_end)].dropna()
@@ -127,8 +124,8 @@ class ForecastViewer(QDialog):
     def open_exceedances(self):
         forecasts = self.model.forecasts
         year = self.forecast_year_select.value()
-        if year in forecasts.forecasts.index.get_level_values(0):
-            values = forecasts.forecasts.loc[(year), 'Value']
+        if year in forecasts:
+            values = forecasts.get(year)
             e = ExceedanceViewer.ExceedanceViewer(self.forecastsTab, values)
             e.exec()
 
@@ -140,7 +137,7 @@ class ForecastViewer(QDialog):
         if isinstance(self.model_plots_ft.tp.items[-1], RectItem):
             self.model_plots_ft.tp.removeItem(self.model_plots_ft.tp.items[-1])
 
-        if year in forecasts.forecasts.index.get_level_values(0):
+        if year in forecasts:
             fcst = forecasts.get_10_30_50_70_90(year)
             scatterItem = RectItem((fcst[0], fcst[4]), (fcst[4], fcst[0]))
             self.model_plots_ft.sp.addItem(scatterItem)
@@ -194,10 +191,8 @@ class ForecastViewer(QDialog):
         self.predictor_area.setHtml(f'<ul>{p_text}</ul>')
 
         # Fit the model
-        df = pd.DataFrame()
-        for predictor in self.model.predictors:
-            df = pd.concat([df, predictor.data], axis=1)
-        df = pd.concat([df, self.model.predictand.data], axis=1).sort_index()
+        df = app.training_cache.collate(
+            self.model.guid, self.model.predictors, self.model.predictand)
         df = df.loc[convert_to_water_year(
             self.model.training_period_start):convert_to_water_year(
             self.model.training_period_end)].dropna()
@@ -270,8 +265,7 @@ class ForecastViewer(QDialog):
                 [str(year), f'{actual:0.5g}', f'{predicted:0.5g}', f'{error:0.5g}',
                  forecast])
 
-        for year in sorted(
-                list(set(self.model.forecasts.forecasts.index.get_level_values(0)))):
+        for year in self.model.forecasts.years():
             if year not in years:
                 forecast = self.model.forecasts.get_10_50_90(year)
                 if np.isnan(forecast[1]):
@@ -3,7 +3,6 @@ from datetime import datetime
 from inspect import signature
 
 import numpy as np
-import pandas as pd
 import pyqtgraph as pg
 from PySide6.QtCore import (Qt, QModelIndex, QSortFilterProxyModel,
                             QAbstractTableModel, QThread)
@@ -273,10 +272,8 @@ class GenModelDialog(QDialog):
         model = self.possible_models[row.row()]
         regression_algorithm = app.regressors[model.regression_model](
             cross_validation=model.cross_validation)
-        df = pd.DataFrame()
-        for predictor in model.predictors:
-            df = pd.concat([df, predictor.data], axis=1)
-        df = pd.concat([df, model.predictand.data], axis=1).sort_index()
+        df = app.training_cache.collate(
+            model.guid, model.predictors, model.predictand)
         df = df.loc[
             convert_to_water_year(self.config.training_start_date):convert_to_water_year(
                 self.config.training_end_date)].dropna()
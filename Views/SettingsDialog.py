@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 
 from PySide6.QtCore import QStringListModel, QDate
@@ -43,6 +44,13 @@ class SettingsDialog(QDialog):
         self.max_pc_modes_setting = ZzQDoubleSpinBox()
         self.max_pc_modes_setting.setMinimum(0.5)
         self.max_pc_modes_setting.setMaximum(0.99)
+        self.worker_processes_setting = ZzQSpinBox()
+        self.worker_processes_setting.setStatusTip(
+            'Models are evaluated, and forecasts generated, in parallel across '
+            'this many processes. Use 1 to run on a single process.')
+        self.worker_processes_setting.setMinimum(1)
+        self.worker_processes_setting.setMaximum(os.cpu_count() or 1)
+        self.worker_processes_setting.setSuffix(' Processes')
 
         layout = QFormLayout()
         layout.setVerticalSpacing(4)
@@ -81,6 +89,10 @@ class SettingsDialog(QDialog):
             '    Maximum cumulative importance for Princ. Comp. retention?',
             self.max_pc_modes_setting
         )
+        layout.addRow(
+            '    Number of worker processes for model search and forecasts',
+            self.worker_processes_setting
+        )
 
         hline = QFrame()
         hline.setFrameShape(QFrame.Shape.HLine)
@@ -129,6 +141,8 @@ class SettingsDialog(QDialog):
             app.settings['model_search_time_limit'])
         self.max_pc_modes_setting.setValue(
             app.settings['max_pc_mode_variance'])
+        self.worker_processes_setting.setValue(
+            app.settings.get('worker_processes', 1))
 
     def store_settings(self):
         date = self.download_start_setting.date().toPython()
@@ -148,3 +162,5 @@ class SettingsDialog(QDialog):
             self.search_time_limit_setting.value())
         app.settings['max_pc_mode_variance'] = (
             self.max_pc_modes_setting.value())
+        app.settings['worker_processes'] = (
+            self.worker_processes_setting.value())
@@ -1,5 +1,6 @@
 import argparse
 import json
+import multiprocessing
 import os
 import sys
 import time
@@ -149,6 +150,10 @@ class PyForecast(QApplication):
         self.model_configurations = ModelConfigurations.ModelConfigurations(self)
         self.saved_models = SavedModels.SavedModelList(self)
 
+        # Cache of resampled and collated training data
+        from Utilities.TrainingCache import TrainingCache
+        self.training_cache = TrainingCache()
+
         # Instantiate the Dataloaders
         from Resources import Dataloaders
         self.dataloaders = Dataloaders.DATALOADERS
@@ -228,6 +233,9 @@ class PyForecast(QApplication):
 
 
 if __name__ == '__main__':
+    # Needed for the model search worker processes in frozen builds
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser(
         'PyForecast',
         description="PyForecast is a statistical modeling tool useful in predicting "